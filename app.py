@@ -1,21 +1,63 @@
 import os
+import io
+import time
+import tracemalloc
+import json
+import base64
+import hashlib
+import hmac
+import random
+import tempfile
+import threading
+import uuid
+import click
+import sqlite3
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, jsonify, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, jsonify, session, send_file, make_response, stream_with_context
+from flask.cli import AppGroup
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
 from dateutil.relativedelta import relativedelta
+from dateutil.rrule import rrule, DAILY, WEEKLY, MONTHLY
 from sqlalchemy import inspect
 from sqlalchemy import text
 from sqlalchemy import func
+from sqlalchemy import event
+from sqlalchemy import insert
+from sqlalchemy import update
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.orm import Session, with_loader_criteria
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
 from werkzeug.utils import secure_filename
-from functools import wraps
+from functools import wraps, lru_cache
 from flask import session
 from zoneinfo import ZoneInfo   # 🔥 ajouter ça
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen.pathobject import PDFPathObject
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib import colors
+from reportlab.lib.colors import black, blue, white
+from reportlab.lib.enums import TA_LEFT, TA_RIGHT
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import (
+    PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle,
+)
 
 TZ_PARIS = ZoneInfo("Europe/Paris")   # 🔥 ajouter ça
 
 
+def paris_now():
+    """Heure de Paris (datetime « aware »), comme les horodatages relus en base."""
+    return datetime.now(TZ_PARIS)
+
 
 def parse_date_optional_time(value):
     if not value:
@@ -63,7 +105,49 @@ app.config["SQLALCHEMY_DATABASE_URI"] = db_url
 
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+
+# Session PostgreSQL à l'heure de Paris : une date (vaccin…) comparée à un
+# horodatage tombe à minuit heure de Paris, pas UTC
+if db_url and db_url.startswith("postgresql"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "connect_args": {"options": "-c timezone=Europe/Paris"},
+    }
+
 db = SQLAlchemy(app)
+
+
+class ParisDateTime(TypeDecorator):
+    """
+    Horodatage stocké en TIMESTAMP WITH TIME ZONE et relu en datetime
+    « aware » Europe/Paris : plus aucune correction de fuseau à la lecture.
+    Une valeur naïve (champ datetime-local d'un formulaire) est comprise
+    comme heure de Paris. SQLite n'a pas de fuseau : on y garde l'heure de
+    Paris sans offset.
+    """
+    impl = db.DateTime
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(timezone=True)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=TZ_PARIS)
+        else:
+            value = value.astimezone(TZ_PARIS)
+        if dialect.name == "sqlite":
+            return value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=TZ_PARIS)
+        return value.astimezone(TZ_PARIS)
+
 # ============================================================
 # MODELS
 # ============================================================
@@ -94,8 +178,10 @@ class Cat(db.Model):
     status = db.Column(db.String(50))
     photo_filename = db.Column(db.String(200))
     entry_reason = db.Column(db.String(100))
+    entry_reason_code = db.Column(db.String(20))   # voir ENTRY_REASON_CODES
     exit_date = db.Column(db.Date)
     exit_reason = db.Column(db.String(100))
+    exit_reason_code = db.Column(db.String(20))    # voir EXIT_REASON_CODES
     adopter_name = db.Column(db.String(120))
     adopter_address = db.Column(db.String(255))
     adopter_phone = db.Column(db.String(50))
@@ -118,6 +204,11 @@ class Cat(db.Model):
     lazy=True,
     cascade="all, delete-orphan"
     )
+
+    __table_args__ = (
+        db.Index("ix_cat_entry_reason_code_entry_date", "entry_reason_code", "entry_date"),
+        db.Index("ix_cat_exit_reason_code_exit_date", "exit_reason_code", "exit_date"),
+    )
     
 class ActivityReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -141,14 +232,74 @@ class ActivityReport(db.Model):
     count_end = db.Column(db.Integer, default=0)            # animaux en fin de mois
 
     pdf_filename = db.Column(db.String(255))                # chemin du PDF sauvegardé
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TZ_PARIS))
-    updated_at = db.Column(db.DateTime)
+    created_at = db.Column(ParisDateTime(), default=paris_now)
+    updated_at = db.Column(ParisDateTime())
+
+    # True : chiffres calculés automatiquement pour un mois clos (cache du
+    # rapport annuel, sans PDF) ; False : rapport validé et généré
+    is_snapshot = db.Column(db.Boolean, default=False, nullable=False)
+
+    # Empreinte des données du PDF (activity_report_hash) : même empreinte =
+    # PDF déjà à jour, pas de nouveau rendu
+    input_hash = db.Column(db.String(64))
+
+    __table_args__ = (
+        db.Index("ux_activity_report_year_month", "year", "month", unique=True),
+    )
+
 
 class PurchaseOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_date = db.Column(db.Date, nullable=False, default=date.today)
     pdf_filename = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TZ_PARIS))
+    created_at = db.Column(ParisDateTime(), default=paris_now)
+
+
+class Product(db.Model):
+    """Article du bon de pré-commande IDF Diffusion."""
+    __tablename__ = "product"
+
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(30), nullable=False, unique=True)
+    label = db.Column(db.String(200), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)   # ordre sur le bon
+
+
+# Catalogue initial IDF Diffusion (référence, désignation), copié dans la
+# table product à sa création
+DEFAULT_PRODUCTS = [
+    ("1000006", "Bidon 5L détergent bactéricide flash DP pin"),
+    ("1000005", "Bidon 5L détergent bactéricide flash DP citron"),
+    ("1000108", "Pulvérisateur 750ml dégraissant virucide IDOS"),
+    ("002023104", "Bidon 1L détergent vaisselle"),
+    ("002020105", "Bidon 5L lessive liquide enzymes"),
+    ("123919", "Bidon 5L eau de javel 9.6°"),
+    ("002026002", "Pousse mousse savon mains 500ml"),
+    ("002061495", "Pulvérisateur 750ml nettoyant vitres"),
+    ("022207001", "Bidon 5L vinaigre ecocert"),
+    ("1000126", "Flacon 750ml WC gel gely bact"),
+    ("124097", "Carton 500 SAD 50L blancs"),
+    ("124858", "Carton 100 SAD 160L 55mm"),
+    ("124056", "Carton 500 SAD 30L corbeilles"),
+    ("132266", "Gant MAPA S-M-L-XL"),
+    ("1052", "Boîte 100 gants jetables latex S-M-L-XL"),
+    ("1082", "Boîte 100 gants jetables nitrile bleu S-M-L-XL"),
+    ("T376", "Paquet 10 éponges double face vert"),
+    ("00HE44", "Paquet 10 éponges n°4"),
+    ("2501003101", "Paquet 10 éponges magiques"),
+    ("T184", "Sachet 5 lavettes microfibre"),
+    ("T117", "Paquet 10 éponges inox"),
+    ("0702070", "Seau essoreur pour frange espagnol"),
+    ("1261", "Frange espagnol microfibre bleue"),
+    ("406900", "Colis 72 rouleaux papier toilette"),
+    ("416895", "Colis 6 bobines dévidage central"),
+    ("0212700001", "Aspirateur poussière"),
+    ("022000730", "Lot 20 sacs aspirateur"),
+]
+DEFAULT_PRODUCT_ROWS = [
+    {"reference": ref, "label": label, "position": i}
+    for i, (ref, label) in enumerate(DEFAULT_PRODUCTS)
+]
 
 
 class Weight(db.Model):
@@ -170,7 +321,7 @@ class DewormingBatch(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TZ_PARIS))
+    created_at = db.Column(ParisDateTime(), default=paris_now)
 
     items = db.relationship(
         "DewormingBatchItem",
@@ -197,11 +348,28 @@ class DewormingBatchItem(db.Model):
 class GeneralAppointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)  # ex : Jardinier, Plombier, Intervention
-    start = db.Column(db.DateTime, nullable=False)
-    end = db.Column(db.DateTime)
+    start = db.Column(ParisDateTime(), nullable=False)
+    end = db.Column(ParisDateTime())
     note = db.Column(db.Text)
     color = db.Column(db.String(20), default="orange")  # couleur dans le calendrier
 
+    # Série (jardinier, ménage…) : une seule ligne, occurrences calculées
+    # à la demande pour la fenêtre du calendrier (voir expand_recurrence)
+    recurrence = db.Column(db.String(10))                  # None / "daily" / "weekly" / "monthly"
+    recurrence_interval = db.Column(db.Integer, nullable=False, default=1)
+    recurrence_until = db.Column(db.Date)                  # dernière date incluse
+    recurrence_exceptions = db.Column(db.Text)             # dates annulées "2026-10-20,2026-11-03"
+
+    # Synchro incrémentale du calendrier (?updated_since= et flux .ics)
+    updated_at = db.Column(ParisDateTime(), default=paris_now, onupdate=paris_now)
+    deleted_at = db.Column(ParisDateTime())     # suppression logique
+
+    __table_args__ = (
+        db.Index("ix_general_appointment_start", "start"),
+        db.Index("ix_general_appointment_end", "end"),
+        db.Index("ix_general_appointment_updated_at", "updated_at"),
+    )
+
 class VaccineType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
@@ -251,9 +419,9 @@ class Note(db.Model):
     content = db.Column(db.Text)
     file_name = db.Column(db.String(200))
     author = db.Column(db.String(120))       # auteur de la note
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TZ_PARIS))
+    created_at = db.Column(ParisDateTime(), default=paris_now)
     veterinarian = db.Column(db.String(120))  # vétérinaire associé à la note
-    updated_at = db.Column(db.DateTime)
+    updated_at = db.Column(ParisDateTime())
     appointment_id = db.Column(db.Integer, db.ForeignKey("appointment.id"), nullable=True)
 
 class Employee(db.Model):
@@ -267,13 +435,17 @@ class Veterinarian(db.Model):
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(ParisDateTime(), nullable=False)
     location = db.Column(db.String(200))
     created_by = db.Column(db.String(120))
 
     # ✅ nouveau : indique si le compte-rendu véto a été validé pour ce RDV
     vet_report_done = db.Column(db.Boolean, default=False)
 
+    # Synchro incrémentale du calendrier (?updated_since= et flux .ics)
+    updated_at = db.Column(ParisDateTime(), default=paris_now, onupdate=paris_now)
+    deleted_at = db.Column(ParisDateTime())     # suppression logique
+
     employees = db.relationship(
         "AppointmentEmployee",
         back_populates="appointment",
@@ -285,6 +457,11 @@ class Appointment(db.Model):
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (
+        db.Index("ix_appointment_date", "date"),
+        db.Index("ix_appointment_updated_at", "updated_at"),
+    )
+
 
 class AppointmentEmployee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -294,6 +471,10 @@ class AppointmentEmployee(db.Model):
     appointment = db.relationship("Appointment", back_populates="employees")
     employee = db.relationship("Employee")
 
+    __table_args__ = (
+        db.Index("ux_appointment_employee", "appointment_id", "employee_id", unique=True),
+    )
+
 
 class AppointmentCat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -303,6 +484,10 @@ class AppointmentCat(db.Model):
     appointment = db.relationship("Appointment", back_populates="cats")
     cat = db.relationship("Cat", back_populates="appointments")
 
+    __table_args__ = (
+        db.Index("ux_appointment_cat", "appointment_id", "cat_id", unique=True),
+    )
+
 class TaskType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
@@ -318,14 +503,14 @@ class CatTask(db.Model):
     task_type_id = db.Column(db.Integer, db.ForeignKey("task_type.id"), nullable=False)
 
     note = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TZ_PARIS), nullable=False)
+    created_at = db.Column(ParisDateTime(), default=paris_now, nullable=False)
 
     due_date = db.Column(db.Date)
 
     is_done = db.Column(db.Boolean, default=False, nullable=False)
 
     done_by = db.Column(db.String(120))
-    done_at = db.Column(db.DateTime)
+    done_at = db.Column(ParisDateTime())
     
     appointment_id = db.Column(db.Integer, db.ForeignKey("appointment.id"), nullable=True)
 
@@ -333,6 +518,65 @@ class CatTask(db.Model):
     task_type = db.relationship("TaskType", back_populates="tasks")
 
 
+class CatSummary(db.Model):
+    """
+    Résumé dénormalisé d'un chat (1 ligne par chat), recalculé dans la même
+    transaction que les écritures sur tâches / notes / vaccins / vermifuges /
+    pesées (voir refresh_cat_summaries).
+    """
+    __tablename__ = "cat_summary"
+
+    cat_id = db.Column(db.Integer, db.ForeignKey("cat.id", ondelete="CASCADE"), primary_key=True)
+    tasks_todo = db.Column(db.Integer, nullable=False, default=0)
+    last_note_at = db.Column(ParisDateTime())
+    last_task_at = db.Column(ParisDateTime())
+    last_vacc_date = db.Column(db.Date)
+    last_weight = db.Column(db.Float)
+    last_weight_date = db.Column(db.Date)
+    last_deworming_date = db.Column(db.Date)
+
+
+class CatVaccineSummary(db.Model):
+    """Dernière injection par (chat, type de vaccin)."""
+    __tablename__ = "cat_vaccine_summary"
+
+    cat_id = db.Column(db.Integer, db.ForeignKey("cat.id", ondelete="CASCADE"), primary_key=True)
+    vaccine_type_id = db.Column(
+        db.Integer, db.ForeignKey("vaccine_type.id", ondelete="CASCADE"), primary_key=True
+    )
+    last_date = db.Column(db.Date, nullable=False)
+    primo = db.Column(db.Boolean, default=False)
+
+
+class DueReminder(db.Model):
+    """
+    Prochain rappel par (chat, vaccin) et par chat pour le vermifuge,
+    recalculé avec les résumés ; le tableau de bord filtre sur next_due.
+    """
+    __tablename__ = "due_reminders"
+
+    id = db.Column(db.Integer, primary_key=True)
+    cat_id = db.Column(db.Integer, db.ForeignKey("cat.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = db.Column(db.String(16), nullable=False)   # "vaccine" / "deworming"
+    vaccine_type_id = db.Column(
+        db.Integer, db.ForeignKey("vaccine_type.id", ondelete="CASCADE"), nullable=True
+    )
+    last_date = db.Column(db.Date, nullable=False)
+    next_due = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_due_reminders_kind_next_due", "kind", "next_due"),
+    )
+
+
+class DataVersion(db.Model):
+    """Compteur de modifications par table (sert aux ETag des API JSON)."""
+    __tablename__ = "data_version"
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 # ============================================================
 # UTILS
 # ============================================================
@@ -350,6 +594,153 @@ def age_text(d: date | None) -> str:
         return f"{rem} mois"
     return f"{years} ans, {rem} mois"
 
+# -------------------- Fonctions SQL portables (PostgreSQL / SQLite) --------------------
+class greatest(FunctionElement):
+    """GREATEST(a, b, ...) portable (max(a, b, ...) en SQLite)."""
+    type = ParisDateTime()
+    name = "greatest"
+    inherit_cache = True
+
+
+@compiles(greatest)
+def _compile_greatest(element, compiler, **kw):
+    return "greatest(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(greatest, "sqlite")
+def _compile_greatest_sqlite(element, compiler, **kw):
+    return "max(%s)" % compiler.process(element.clauses, **kw)
+
+
+class date_to_timestamp(FunctionElement):
+    """
+    date -> horodatage à minuit, pour comparer une date à des horodatages
+    (GREATEST, tri). SQLite stocke les deux en texte : « 2026-01-01 » doit
+    y devenir « 2026-01-01 00:00:00.000000 », sinon il se trie avant.
+    """
+    type = ParisDateTime()
+    name = "date_to_timestamp"
+    inherit_cache = True
+
+
+@compiles(date_to_timestamp)
+def _compile_date_to_timestamp(element, compiler, **kw):
+    return "CAST(%s AS TIMESTAMP WITH TIME ZONE)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(date_to_timestamp, "sqlite")
+def _compile_date_to_timestamp_sqlite(element, compiler, **kw):
+    return "(%s || ' 00:00:00.000000')" % compiler.process(element.clauses, **kw)
+
+
+class add_days(FunctionElement):
+    """date + n jours, portable (date(x, '+n days') en SQLite)."""
+    type = db.Date()
+    name = "add_days"
+    inherit_cache = True
+
+
+@compiles(add_days)
+def _compile_add_days(element, compiler, **kw):
+    day, n = list(element.clauses)
+    return "(%s + CAST(%s AS INTEGER))" % (compiler.process(day, **kw), compiler.process(n, **kw))
+
+
+@compiles(add_days, "sqlite")
+def _compile_add_days_sqlite(element, compiler, **kw):
+    day, n = list(element.clauses)
+    return "date(%s, '+' || (%s) || ' days')" % (compiler.process(day, **kw), compiler.process(n, **kw))
+
+
+class add_months(FunctionElement):
+    """
+    date + n mois, ramenée au dernier jour du mois si besoin (31/12 + 2 mois
+    = 28 ou 29/02), comme relativedelta. PostgreSQL le fait avec un interval ;
+    SQLite déborde sur le mois suivant, d'où le min() avec la fin de mois.
+    """
+    type = db.Date()
+    name = "add_months"
+    inherit_cache = True
+
+
+@compiles(add_months)
+def _compile_add_months(element, compiler, **kw):
+    day, n = list(element.clauses)
+    return "CAST(%s + CAST(%s AS INTEGER) * INTERVAL '1 month' AS DATE)" % (
+        compiler.process(day, **kw), compiler.process(n, **kw)
+    )
+
+
+@compiles(add_months, "sqlite")
+def _compile_add_months_sqlite(element, compiler, **kw):
+    day, n = list(element.clauses)
+    d, m = compiler.process(day, **kw), compiler.process(n, **kw)
+    return (
+        "min(date(%s, '+' || (%s) || ' months'), "
+        "date(%s, 'start of month', '+' || ((%s) + 1) || ' months', '-1 day'))" % (d, m, d, m)
+    )
+
+
+class unicode_lower(FunctionElement):
+    """
+    lower() qui gère les accents (« É » → « é »). Le lower() de SQLite ne
+    traite que l'ASCII : on y appelle str.lower, enregistrée à la connexion.
+    """
+    type = db.String()
+    name = "unicode_lower"
+    inherit_cache = True
+
+
+@compiles(unicode_lower)
+def _compile_unicode_lower(element, compiler, **kw):
+    return "lower(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(unicode_lower, "sqlite")
+def _compile_unicode_lower_sqlite(element, compiler, **kw):
+    return "py_lower(%s)" % compiler.process(element.clauses, **kw)
+
+
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "py_lower", 1, lambda v: v.lower() if isinstance(v, str) else v, deterministic=True
+        )
+
+
+def parse_fields_param(available: dict) -> list[str]:
+    """
+    Lit le paramètre ?fields=a,b,c d'une API JSON. Sans paramètre : tous les
+    champs, dans l'ordre de `available`. Lève ValueError si un champ est inconnu.
+    """
+    raw = (request.args.get("fields") or "").strip()
+    if not raw:
+        return list(available)
+
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise ValueError(f"champ(s) inconnu(s) : {', '.join(unknown)}")
+    return fields
+
+
+def last_update_text(last_note_at, last_task_at, last_vacc_date) -> str:
+    """
+    Texte "Dernière mise à jour" d'un chat à partir des dates max déjà
+    agrégées en SQL (note, tâche, vaccin). Les vaccins n'ont qu'une date :
+    on les place à minuit heure de Paris.
+    """
+    last_dates = [d for d in (last_note_at, last_task_at) if d]
+    if last_vacc_date:
+        last_dates.append(
+            datetime.combine(last_vacc_date, datetime.min.time()).replace(tzinfo=TZ_PARIS)
+        )
+
+    if not last_dates:
+        return "—"
+    return max(last_dates).strftime("%d/%m/%Y %H:%M")
+
 def count_cats_present_on(day: date) -> int:
     """
     Retourne combien de chats sont présents au refuge à une date donnée.
@@ -366,11 +757,181 @@ def count_cats_present_on(day: date) -> int:
         Cat.status.notin_(["adopté", "décédé", "famille d'accueil"])
     ).count()
 
+
+def occupancy_deltas(end: date) -> list:
+    """
+    Variations de l'effectif jusqu'à `end`, triées par date : +1 à l'entrée,
+    -1 à la sortie (même population que count_cats_present_on ; une fiche
+    sortie avant d'être entrée n'est jamais comptée).
+    """
+    counted = (
+        Cat.entry_date.isnot(None),
+        Cat.status.notin_(["adopté", "décédé", "famille d'accueil"]),
+        db.or_(Cat.exit_date.is_(None), Cat.exit_date >= Cat.entry_date),
+    )
+    events = db.union_all(
+        select(Cat.entry_date.label("day"), db.literal(1).label("delta"))
+        .where(*counted, Cat.entry_date <= end),
+        select(Cat.exit_date.label("day"), db.literal(-1).label("delta"))
+        .where(*counted, Cat.exit_date.isnot(None), Cat.exit_date <= end),
+    ).subquery()
+
+    return (
+        db.session.query(events.c.day, func.sum(events.c.delta))
+        .group_by(events.c.day)
+        .order_by(events.c.day)
+        .all()
+    )
+
+
+def occupancy_series(start: date, end: date, step: str = "day") -> list[dict]:
+    """
+    Effectif présent + entrées / sorties par code de motif, jour par jour
+    (step="day") ou mois par mois (step="month", effectif au dernier jour
+    du mois). Un seul passage trié sur les événements d'entrée / sortie
+    (somme cumulée des +1 / -1) au lieu d'un COUNT par date.
+    Les entrées / sorties suivent les règles du rapport d'activité (hors
+    famille d'accueil) ; un motif sans code est compté en "other".
+    """
+    def bucket(day):
+        return day.isoformat() if step == "day" else day.strftime("%Y-%m")
+
+    # Périodes de la série (bornes incluses)
+    periods = []
+    day = start
+    while day <= end:
+        if step == "day":
+            last = day
+        else:
+            last = min((day.replace(day=1) + relativedelta(months=1)) - timedelta(days=1), end)
+        periods.append((bucket(day), last))
+        day = last + timedelta(days=1)
+
+    # Effectif : somme cumulée des variations, lue en un seul passage
+    present_at = {}
+    deltas = occupancy_deltas(end)
+    running, i = 0, 0
+    for key, last in periods:
+        while i < len(deltas) and deltas[i][0] <= last:
+            running += int(deltas[i][1])
+            i += 1
+        present_at[key] = running
+
+    # Entrées / sorties par code de motif
+    moves = {key: {"entries": {}, "exits": {}} for key, _ in periods}
+    for kind, date_column, code_column in (
+        ("entries", Cat.entry_date, Cat.entry_reason_code),
+        ("exits", Cat.exit_date, Cat.exit_reason_code),
+    ):
+        rows = (
+            db.session.query(date_column, code_column, func.count(Cat.id))
+            .filter(
+                date_column >= start,
+                date_column <= end,
+                Cat.status != "famille d'accueil",
+            )
+            .group_by(date_column, code_column)
+            .all()
+        )
+        for day, code, n in rows:
+            counts = moves[bucket(day)][kind]
+            counts[code or "other"] = counts.get(code or "other", 0) + n
+
+    return [
+        {"period": key, "present": present_at[key], **moves[key]}
+        for key, _ in periods
+    ]
+
+
+# Codes des motifs d'entrée / de sortie (cat.entry_reason_code,
+# cat.exit_reason_code) : (code, mots recherchés dans le libellé). L'ordre
+# compte : le premier code qui correspond l'emporte. Sert à classer les
+# libellés libres (API, anciennes fiches) ; les formulaires envoient des
+# libellés connus.
+ENTRY_REASON_CODES = (
+    ("abandon", ("abandon",)),
+    ("return", ("retour",)),
+    ("found", ("trouv",)),
+)
+EXIT_REASON_CODES = (
+    ("placed", ("plac",)),
+    ("returned_owner", ("propri",)),
+    ("deceased", ("déc", "dec")),
+    ("escaped", ("échapp", "echapp")),
+    ("transferred", ("transfér", "transfer")),
+)
+
+
+def reason_code(reason, categories):
+    """Code du libellé `reason` (None si aucun mot ne correspond)."""
+    r = (reason or "").lower()
+    for key, words in categories:
+        if any(word in r for word in words):
+            return key
+    return None
+
+
+def reason_category(column, categories):
+    """Même classement en SQL (CASE) : sert à la migration des fiches existantes."""
+    reason = unicode_lower(func.coalesce(column, ""))
+    return db.case(
+        *[
+            (db.or_(*[reason.like(f"%{word}%") for word in words]), key)
+            for key, words in categories
+        ],
+        else_=None,
+    )
+
+
+class LazyCatLists(Mapping):
+    """
+    Listes de chats par code de motif, chargées en une requête au premier
+    accès (seulement si le gabarit les affiche).
+    """
+
+    def __init__(self, categories, date_column, code_column, start_date, end_date):
+        self.keys_ = [key for key, _ in categories]
+        self.date_column = date_column
+        self.code_column = code_column
+        self.start_date = start_date
+        self.end_date = end_date
+        self.lists = None
+
+    def _load(self):
+        if self.lists is None:
+            self.lists = {key: [] for key in self.keys_}
+            rows = (
+                db.session.query(Cat)
+                .filter(
+                    self.code_column.in_(self.keys_),
+                    self.date_column >= self.start_date,
+                    self.date_column <= self.end_date,
+                    Cat.status != "famille d'accueil",
+                )
+                .order_by(Cat.id)
+                .all()
+            )
+            for cat in rows:
+                self.lists[getattr(cat, self.code_column.key)].append(cat)
+        return self.lists
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+
 def compute_activity_stats(year: int, month: int):
     """
     Calcule les entrées / sorties / nb début / nb fin pour un mois donné,
     selon la logique comptable demandée :
       count_start + entries_total - exits_total = count_end
+    Les compteurs sont lus par code de motif (requêtes groupées sur index) ;
+    les listes de chats par code ne sont chargées que si on les lit.
     """
 
     # Bornes du mois
@@ -388,86 +949,52 @@ def compute_activity_stats(year: int, month: int):
         Cat.status != "famille d'accueil"
     ).count()
 
-    # 🔥 2) Entrées pendant le mois
-    cats_entries = Cat.query.filter(
-        Cat.entry_date >= start_date,
-        Cat.entry_date <= end_date,
-        Cat.status != "famille d'accueil"
-    ).all()
-
-    entries_lists = {"abandon": [], "return": [], "found": []}
-
-    for c in cats_entries:
-        r = (c.entry_reason or "").lower()
-        if "abandon" in r:
-            entries_lists["abandon"].append(c)
-        elif "retour" in r:
-            entries_lists["return"].append(c)
-        elif "trouv" in r:
-            entries_lists["found"].append(c)
-
-    entries_abandon = len(entries_lists["abandon"])
-    entries_return = len(entries_lists["return"])
-    entries_found = len(entries_lists["found"])
-    entries_total = entries_abandon + entries_return + entries_found
-
-    # 🔥 3) Sorties pendant le mois
-    cats_exits = Cat.query.filter(
-        Cat.exit_date >= start_date,
-        Cat.exit_date <= end_date,
-        Cat.status != "famille d'accueil"
-    ).all()
+    # 🔥 2) Entrées et 3) sorties du mois : comptage par code, servi par
+    # les index (code, date)
+    def count_by_code(code_column, date_column, categories):
+        keys = [key for key, _ in categories]
+        counts = dict(
+            db.session.query(code_column, func.count(Cat.id))
+            .filter(
+                code_column.in_(keys),
+                date_column >= start_date,
+                date_column <= end_date,
+                Cat.status != "famille d'accueil",
+            )
+            .group_by(code_column)
+            .all()
+        )
+        return {key: counts.get(key, 0) for key in keys}
 
-    exits_lists = {
-        "placed": [],
-        "returned_owner": [],
-        "deceased": [],
-        "escaped": [],
-        "transferred": [],
-    }
+    row = {"count_start": count_start}
+    row.update({
+        f"entries_{key}": n
+        for key, n in count_by_code(Cat.entry_reason_code, Cat.entry_date, ENTRY_REASON_CODES).items()
+    })
+    row.update({
+        f"exits_{key}": n
+        for key, n in count_by_code(Cat.exit_reason_code, Cat.exit_date, EXIT_REASON_CODES).items()
+    })
 
-    for c in cats_exits:
-        r = (c.exit_reason or "").lower()
-        if "plac" in r:
-            exits_lists["placed"].append(c)
-        elif "propri" in r:
-            exits_lists["returned_owner"].append(c)
-        elif "déc" in r or "dec" in r:
-            exits_lists["deceased"].append(c)
-        elif "échapp" in r or "echapp" in r:
-            exits_lists["escaped"].append(c)
-        elif "transfér" in r or "transfer" in r:
-            exits_lists["transferred"].append(c)
-
-    exits_placed = len(exits_lists["placed"])
-    exits_returned_owner = len(exits_lists["returned_owner"])
-    exits_deceased = len(exits_lists["deceased"])
-    exits_escaped = len(exits_lists["escaped"])
-    exits_transferred = len(exits_lists["transferred"])
-    exits_total = (
-        exits_placed +
-        exits_returned_owner +
-        exits_deceased +
-        exits_escaped +
-        exits_transferred
-    )
+    entries_total = sum(row[f"entries_{key}"] for key, _ in ENTRY_REASON_CODES)
+    exits_total = sum(row[f"exits_{key}"] for key, _ in EXIT_REASON_CODES)
 
     # 🔥 4) Animaux en fin de mois = FORMULE DEMANDÉE
-    count_end = count_start + entries_total - exits_total
+    count_end = row["count_start"] + entries_total - exits_total
 
     counts = {
-        "entries_abandon": entries_abandon,
-        "entries_return": entries_return,
-        "entries_found": entries_found,
+        "entries_abandon": row["entries_abandon"],
+        "entries_return": row["entries_return"],
+        "entries_found": row["entries_found"],
         "entries_total": entries_total,
 
-        "count_start": count_start,
+        "count_start": row["count_start"],
 
-        "exits_placed": exits_placed,
-        "exits_returned_owner": exits_returned_owner,
-        "exits_deceased": exits_deceased,
-        "exits_escaped": exits_escaped,
-        "exits_transferred": exits_transferred,
+        "exits_placed": row["exits_placed"],
+        "exits_returned_owner": row["exits_returned_owner"],
+        "exits_deceased": row["exits_deceased"],
+        "exits_escaped": row["exits_escaped"],
+        "exits_transferred": row["exits_transferred"],
         "exits_total": exits_total,
 
         "count_end": count_end,
@@ -475,13 +1002,659 @@ def compute_activity_stats(year: int, month: int):
 
     return {
         "counts": counts,
-        "entries_lists": entries_lists,
-        "exits_lists": exits_lists,
+        "entries_lists": LazyCatLists(
+            ENTRY_REASON_CODES, Cat.entry_date, Cat.entry_reason_code, start_date, end_date
+        ),
+        "exits_lists": LazyCatLists(
+            EXIT_REASON_CODES, Cat.exit_date, Cat.exit_reason_code, start_date, end_date
+        ),
         "start_date": start_date,
         "end_date": end_date,
     }
 
 
+# Compteurs d'un rapport d'activité (colonnes de ActivityReport)
+ACTIVITY_COUNT_FIELDS = [
+    "entries_abandon",
+    "entries_return",
+    "entries_found",
+    "entries_total",
+    "count_start",
+    "exits_placed",
+    "exits_returned_owner",
+    "exits_deceased",
+    "exits_escaped",
+    "exits_transferred",
+    "exits_total",
+    "count_end",
+]
+
+
+def month_bounds(year: int, month: int):
+    """Premier et dernier jour du mois."""
+    start_date = date(year, month, 1)
+    return start_date, start_date + relativedelta(months=1) - timedelta(days=1)
+
+
+def activity_counts_for_months(year: int, months) -> dict:
+    """
+    Compteurs du rapport d'activité de plusieurs mois d'une année, en une
+    seule requête (un passage sur cat, un count(CASE) par mois et par
+    compteur). Mêmes règles que compute_activity_stats.
+    """
+    months = list(months)
+    if not months:
+        return {}
+
+    def count_if(*conditions):
+        return func.count(db.case((db.and_(*conditions), 1)))
+
+    columns = []
+    for month in months:
+        start_date, end_date = month_bounds(year, month)
+        entered = db.and_(Cat.entry_date >= start_date, Cat.entry_date <= end_date)
+        exited = db.and_(Cat.exit_date >= start_date, Cat.exit_date <= end_date)
+
+        columns.append(count_if(
+            Cat.entry_date < start_date,
+            db.or_(Cat.exit_date.is_(None), Cat.exit_date >= start_date),
+        ).label(f"m{month}_count_start"))
+        columns += [
+            count_if(entered, Cat.entry_reason_code == key).label(f"m{month}_entries_{key}")
+            for key, _ in ENTRY_REASON_CODES
+        ]
+        columns += [
+            count_if(exited, Cat.exit_reason_code == key).label(f"m{month}_exits_{key}")
+            for key, _ in EXIT_REASON_CODES
+        ]
+
+    row = (
+        db.session.query(*columns)
+        .filter(Cat.status != "famille d'accueil")
+        .one()
+    )._asdict()
+
+    result = {}
+    for month in months:
+        counts = {
+            f[len(f"m{month}_"):]: n
+            for f, n in row.items()
+            if f.startswith(f"m{month}_")
+        }
+        counts["entries_total"] = sum(counts[f"entries_{key}"] for key, _ in ENTRY_REASON_CODES)
+        counts["exits_total"] = sum(counts[f"exits_{key}"] for key, _ in EXIT_REASON_CODES)
+        counts["count_end"] = counts["count_start"] + counts["entries_total"] - counts["exits_total"]
+        result[month] = counts
+    return result
+
+
+def activity_report_years() -> range:
+    """Années qui ont un rapport annuel : de la première entrée de chat à l'année en cours."""
+    current = datetime.now(TZ_PARIS).year
+    first_entry = db.session.query(func.min(Cat.entry_date)).scalar()
+    return range(min(first_entry.year, current) if first_entry else current, current + 1)
+
+
+def compute_annual_activity(year: int):
+    """
+    Rapport annuel : compteurs des 12 mois + totaux (`year` dans
+    activity_report_years()).
+    - mois clos avec un rapport généré : chiffres validés du rapport ;
+    - mois clos sans rapport : calculés une fois puis gardés en instantané
+      (ActivityReport.is_snapshot) ; ils ne sont plus jamais recalculés ;
+    - mois en cours : calculé à chaque fois ; mois futurs et mois d'avant
+      la première entrée de chat : vides.
+    """
+    today = datetime.now(TZ_PARIS).date()
+    first_entry = db.session.query(func.min(Cat.entry_date)).scalar() or today
+
+    stored = {r.month: r for r in ActivityReport.query.filter_by(year=year)}
+
+    closed = [
+        m for m in range(1, 13)
+        if first_entry <= month_bounds(year, m)[1] < today
+    ]
+    live = [m for m in range(1, 13) if month_bounds(year, m)[0] <= today <= month_bounds(year, m)[1]]
+    missing = [m for m in closed if m not in stored]
+
+    computed = activity_counts_for_months(year, missing + live)
+
+    for month in missing:
+        report = ActivityReport(year=year, month=month, is_snapshot=True)
+        for field, value in computed[month].items():
+            setattr(report, field, value)
+        db.session.add(report)
+        stored[month] = report
+    if missing:
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # première visite simultanée : l'autre requête a déjà figé ces mois
+            db.session.rollback()
+            stored = {r.month: r for r in ActivityReport.query.filter_by(year=year)}
+
+    months = []
+    for month in range(1, 13):
+        if month in live:
+            counts, source = computed[month], "live"
+        elif month in stored:
+            report = stored[month]
+            counts = {f: getattr(report, f) or 0 for f in ACTIVITY_COUNT_FIELDS}
+            source = "snapshot" if report.is_snapshot else "report"
+        else:
+            counts, source = None, None
+        months.append({"month": month, "counts": counts, "source": source})
+
+    filled = [m["counts"] for m in months if m["counts"]]
+    totals = None
+    if filled:
+        totals = {
+            f: sum(c[f] for c in filled)
+            for f in ACTIVITY_COUNT_FIELDS
+            if f not in ("count_start", "count_end")
+        }
+        totals["count_start"] = filled[0]["count_start"]
+        totals["count_end"] = filled[-1]["count_end"]
+
+    return {"year": year, "months": months, "totals": totals}
+
+
+# -------------------- Outils PDF (reportlab) --------------------
+# Ressources construites une seule fois par process et partagées par les
+# générateurs de PDF (rapport d'activité, bon de commande).
+MONTH_NAMES_UPPER = {
+    1: "JANVIER", 2: "FÉVRIER", 3: "MARS", 4: "AVRIL",
+    5: "MAI", 6: "JUIN", 7: "JUILLET", 8: "AOÛT",
+    9: "SEPTEMBRE", 10: "OCTOBRE", 11: "NOVEMBRE", 12: "DÉCEMBRE",
+}
+
+PDF_SAMPLE_STYLES = getSampleStyleSheet()
+_PDF_BASE_STYLE = PDF_SAMPLE_STYLES["Normal"]
+
+
+@lru_cache(maxsize=1)
+def pdf_logo():
+    """Logo du refuge (ImageReader lu une fois), ou None si le fichier manque."""
+    logo_path = os.path.join(app.static_folder, "logo_faa.png")
+    if not os.path.exists(logo_path):
+        return None
+    return ImageReader(logo_path)
+
+
+@lru_cache(maxsize=None)
+def pdf_paragraph_style(font_name="Helvetica", font_size=12, color=black, align=TA_LEFT):
+    """Style de paragraphe partagé, un par (police, taille, couleur, alignement)."""
+    return ParagraphStyle(
+        name=f"{font_name}-{font_size}-{color.hexval()}-{align}",
+        parent=_PDF_BASE_STYLE,
+        fontName=font_name,
+        fontSize=font_size,
+        textColor=color,
+        alignment=align,
+    )
+
+
+def pdf_text_in_box(c, text, x, y, width, height,
+                    align=TA_LEFT, font_name="Helvetica",
+                    font_size=12, color=black):
+    """Texte multi-ligne (balises Paragraph) centré verticalement dans une case."""
+    p = Paragraph(text, pdf_paragraph_style(font_name, font_size, color, align))
+    p_width, p_height = p.wrapOn(c, width, height)
+    y_offset = (height - p_height) / 2
+    p.drawOn(c, x, y + y_offset)
+
+
+def pdf_table_grid(x, top, col_widths, row_height, n_rows):
+    """
+    Grille d'un tableau (cadre, lignes, séparateurs de colonnes) en un seul
+    chemin, indépendant du canvas. `top` = haut de la première ligne.
+    """
+    path = PDFPathObject()
+    width = sum(col_widths)
+    bottom = top - n_rows * row_height
+    path.rect(x, bottom, width, n_rows * row_height)
+    for i in range(1, n_rows):
+        y = top - i * row_height
+        path.moveTo(x, y)
+        path.lineTo(x + width, y)
+    col_x = x
+    for col_w in col_widths[:-1]:
+        col_x += col_w
+        path.moveTo(col_x, bottom)
+        path.lineTo(col_x, top)
+    return path
+
+
+def write_pdf_atomic(folder, filename, render):
+    """
+    `render(f)` écrit le PDF dans un fichier temporaire du dossier cible,
+    synchronisé sur disque puis renommé : un téléchargement concurrent lit
+    l'ancien fichier ou le nouveau, jamais un fichier à moitié écrit.
+    """
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            render(f)
+            f.flush()
+            os.fsync(f.fileno())
+        file_path = os.path.join(folder, filename)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return file_path
+
+
+def send_pdf(file_path, download_name=None):
+    """
+    Sert un PDF du disque : ETag + Last-Modified (304 si inchangé) et
+    requêtes Range. Sans `download_name`, affiché dans le navigateur.
+    """
+    response = send_file(
+        file_path,
+        mimetype="application/pdf",
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        last_modified=os.path.getmtime(file_path),
+    )
+    # même nom de fichier réécrit à chaque génération : toujours revalider
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# -------------------- File de génération des PDF --------------------
+PDF_JOB_WORKERS = int(os.environ.get("PDF_JOB_WORKERS", 2))
+PDF_JOB_TTL = 3600   # secondes pendant lesquelles un job terminé reste consultable
+
+
+class PdfJobQueue:
+    """
+    Génération des PDF hors requête (par process) : pool de threads borné,
+    statut de chaque job gardé en mémoire et consulté par /documents/jobs/<id>.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, build, *args):
+        """`build(*args)` tourne dans un contexte d'app et renvoie folder/filename/download_name."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "pending",
+            "error": None,
+            "folder": None,
+            "filename": None,
+            "download_name": None,
+            "created": time.monotonic(),
+        }
+        with self.lock:
+            self.purge()
+            self.jobs[job["id"]] = job
+        self.executor.submit(self.run, job, build, args)
+        return job["id"]
+
+    def run(self, job, build, args):
+        job["status"] = "running"
+        try:
+            with app.app_context():
+                result = build(*args)
+        except Exception as e:
+            app.logger.exception("Génération PDF %s échouée", job["kind"])
+            job.update(status="error", error=str(e))
+        else:
+            job.update(status="done", **result)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def purge(self):
+        limit = time.monotonic() - PDF_JOB_TTL
+        for job_id in [j for j, job in self.jobs.items() if job["created"] < limit]:
+            del self.jobs[job_id]
+
+
+pdf_jobs = PdfJobQueue(PDF_JOB_WORKERS)
+
+
+# -------------------- Versions de données + ETag --------------------
+@event.listens_for(Session, "after_flush")
+def bump_versions_after_flush(session, flush_context):
+    """Incrémente data_version pour chaque table écrite pendant le flush."""
+    written = list(session.new) + list(session.deleted)
+    written += [obj for obj in session.dirty if session.is_modified(obj)]
+    tables = {obj.__table__.name for obj in written}
+    tables.discard(DataVersion.__tablename__)
+    if tables:
+        session.connection().execute(
+            update(DataVersion)
+            .where(DataVersion.table_name.in_(tables))
+            .values(version=DataVersion.version + 1)
+        )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def bump_versions_on_bulk_write(orm_execute_state):
+    """Même chose pour les query.delete() / update() / insert() en masse."""
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.local_table.name == DataVersion.__tablename__:
+        return
+    orm_execute_state.session.connection().execute(
+        update(DataVersion)
+        .where(DataVersion.table_name == mapper.local_table.name)
+        .values(version=DataVersion.version + 1)
+    )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def hide_deleted_appointments(orm_execute_state):
+    """
+    RDV supprimés logiquement (deleted_at) invisibles dans toutes les requêtes
+    ORM, sauf avec execution_options(include_deleted=True) (synchro calendrier).
+    """
+    if (
+        orm_execute_state.is_select
+        and not orm_execute_state.is_column_load
+        and not orm_execute_state.execution_options.get("include_deleted", False)
+    ):
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            with_loader_criteria(Appointment, Appointment.deleted_at.is_(None), include_aliases=True),
+            with_loader_criteria(GeneralAppointment, GeneralAppointment.deleted_at.is_(None), include_aliases=True),
+        )
+
+
+# -------------------- Résumés par chat (cat_summary) --------------------
+SUMMARY_SOURCES = ("cat_task", "note", "vaccination", "deworming", "weight")
+
+
+def _pending_summaries(session) -> set:
+    return session.info.setdefault("cat_summary_pending", set())
+
+
+@event.listens_for(Session, "after_flush")
+def collect_summary_cats_after_flush(session, flush_context):
+    """Note les chats dont le résumé doit être recalculé avant le commit."""
+    pending = _pending_summaries(session)
+    deleted_cats = set()
+
+    for obj in session.new:
+        if isinstance(obj, Cat):
+            pending.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Cat):
+            deleted_cats.add(obj.id)
+
+    written = list(session.new) + list(session.deleted)
+    written += [obj for obj in session.dirty if session.is_modified(obj)]
+    for obj in written:
+        if obj.__table__.name not in SUMMARY_SOURCES:
+            continue
+        pending.add(obj.cat_id)
+        # changement de chat : l'ancien doit aussi être recalculé
+        pending.update(v for v in inspect(obj).attrs.cat_id.history.deleted if v)
+
+    if deleted_cats:
+        pending.difference_update(deleted_cats)
+        conn = session.connection()
+        conn.execute(delete(CatSummary).where(CatSummary.cat_id.in_(deleted_cats)))
+        conn.execute(delete(CatVaccineSummary).where(CatVaccineSummary.cat_id.in_(deleted_cats)))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def collect_summary_cats_on_bulk_write(orm_execute_state):
+    """Idem pour les query.delete() / update() / insert() en masse."""
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.local_table.name not in SUMMARY_SOURCES:
+        return
+
+    pending = _pending_summaries(orm_execute_state.session)
+    if orm_execute_state.is_insert:
+        params = orm_execute_state.parameters or []
+        if isinstance(params, dict):
+            params = [params]
+        pending.update(p["cat_id"] for p in params if p.get("cat_id"))
+    else:
+        # les lignes vont disparaître / changer : on lit les chats concernés avant
+        table = mapper.local_table
+        stmt = select(table.c.cat_id).distinct()
+        if orm_execute_state.statement.whereclause is not None:
+            stmt = stmt.where(orm_execute_state.statement.whereclause)
+        pending.update(orm_execute_state.session.connection().execute(stmt).scalars())
+
+
+@event.listens_for(Session, "before_commit")
+def refresh_summaries_before_commit(session):
+    flush_cat_summaries(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def clear_summaries_after_rollback(session):
+    _pending_summaries(session).clear()
+
+
+def flush_cat_summaries(session=None):
+    """Flush puis recalcule les résumés en attente (appelé avant chaque commit)."""
+    session = session or db.session
+    session.flush()
+    pending = _pending_summaries(session)
+    if pending:
+        refresh_cat_summaries(session.connection(), pending)
+        pending.clear()
+
+
+def cat_summary_select():
+    """SELECT des valeurs attendues de cat_summary (sous-requêtes corrélées sur cat)."""
+    def latest(column, model, *where):
+        return select(column).where(model.cat_id == Cat.id, *where).scalar_subquery()
+
+    last_weight = (
+        select(Weight.weight)
+        .where(Weight.cat_id == Cat.id)
+        .order_by(Weight.date.desc(), Weight.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    return select(
+        Cat.id.label("cat_id"),
+        latest(func.count(CatTask.id), CatTask, CatTask.is_done.is_(False)).label("tasks_todo"),
+        latest(func.max(Note.created_at), Note).label("last_note_at"),
+        latest(func.max(CatTask.created_at), CatTask).label("last_task_at"),
+        latest(func.max(Vaccination.date), Vaccination).label("last_vacc_date"),
+        last_weight.label("last_weight"),
+        latest(func.max(Weight.date), Weight).label("last_weight_date"),
+        latest(func.max(Deworming.date), Deworming).label("last_deworming_date"),
+    )
+
+
+def cat_vaccine_summary_select(cat_ids=None):
+    """
+    SELECT de la dernière injection par (chat, type) : ROW_NUMBER() sur
+    l'historique, la plus récente d'abord (puis la dernière saisie).
+    """
+    ranked = (
+        select(
+            Vaccination.cat_id,
+            Vaccination.vaccine_type_id,
+            Vaccination.date.label("last_date"),
+            func.coalesce(Vaccination.primo, False).label("primo"),
+            func.row_number().over(
+                partition_by=(Vaccination.cat_id, Vaccination.vaccine_type_id),
+                order_by=(Vaccination.date.desc(), Vaccination.id.desc()),
+            ).label("rn"),
+        )
+        .where(Vaccination.date.is_not(None))
+    )
+    if cat_ids is not None:
+        ranked = ranked.where(Vaccination.cat_id.in_(cat_ids))
+    ranked = ranked.subquery()
+
+    return select(
+        ranked.c.cat_id,
+        ranked.c.vaccine_type_id,
+        ranked.c.last_date,
+        ranked.c.primo,
+    ).where(ranked.c.rn == 1)
+
+
+def vaccine_reminders_select(latest):
+    """
+    Prochain rappel par (chat, vaccin) à partir de `latest` (cat_id,
+    vaccine_type_id, last_date, primo) : +30 jours après une primo, +365 sinon.
+    """
+    return select(
+        latest.c.cat_id,
+        latest.c.vaccine_type_id,
+        latest.c.last_date,
+        add_days(latest.c.last_date, db.case((latest.c.primo.is_(True), 30), else_=365)).label("next_due"),
+    )
+
+
+def deworming_reminders_select(latest):
+    """Prochain vermifuge par chat à partir de `latest` (cat_id, last_date) : +2 mois."""
+    return select(
+        latest.c.cat_id,
+        latest.c.last_date,
+        add_months(latest.c.last_date, 2).label("next_due"),
+    ).where(latest.c.last_date.is_not(None))
+
+
+def due_reminders_select(cat_ids=None):
+    """
+    SELECT des lignes attendues de due_reminders (cat_id, kind,
+    vaccine_type_id, last_date, next_due), lues dans les résumés.
+    """
+    vaccine_due = vaccine_reminders_select(CatVaccineSummary.__table__)
+    latest_deworming = select(
+        CatSummary.cat_id.label("cat_id"),
+        CatSummary.last_deworming_date.label("last_date"),
+    )
+    if cat_ids is not None:
+        vaccine_due = vaccine_due.where(CatVaccineSummary.cat_id.in_(cat_ids))
+        latest_deworming = latest_deworming.where(CatSummary.cat_id.in_(cat_ids))
+
+    v = vaccine_due.subquery()
+    d = deworming_reminders_select(latest_deworming.subquery()).subquery()
+    return db.union_all(
+        select(v.c.cat_id, db.literal("vaccine"), v.c.vaccine_type_id, v.c.last_date, v.c.next_due),
+        select(d.c.cat_id, db.literal("deworming"), db.null(), d.c.last_date, d.c.next_due),
+    )
+
+
+def refresh_cat_summaries(conn, cat_ids=None):
+    """
+    Recalcule cat_summary, cat_vaccine_summary puis due_reminders pour
+    `cat_ids` (tous les chats si None), sur la connexion de la transaction
+    en cours.
+    """
+    summary_cols = [c.name for c in CatSummary.__table__.columns]
+    vaccine_cols = [c.name for c in CatVaccineSummary.__table__.columns]
+
+    if cat_ids is not None:
+        cat_ids = list(cat_ids)
+
+    # Verrou sur les chats concernés (dans l'ordre des ids, sans interblocage) :
+    # deux rafraîchissements du même chat (deux requêtes, ou une requête et la
+    # reconstruction de nuit) passent l'un après l'autre. Sinon, en READ
+    # COMMITTED, les deux DELETE puis les deux INSERT se croisent et le second
+    # commit échoue sur la clé primaire de cat_summary. (Sans effet en SQLite,
+    # qui n'a qu'un écrivain à la fois.)
+    lock = select(Cat.id).order_by(Cat.id).with_for_update()
+    if cat_ids is not None:
+        lock = lock.where(Cat.id.in_(cat_ids))
+    conn.execute(lock).all()
+
+    summary_sel = cat_summary_select()
+    vaccine_sel = cat_vaccine_summary_select(cat_ids)
+    del_summary = delete(CatSummary)
+    del_vaccine = delete(CatVaccineSummary)
+
+    if cat_ids is not None:
+        summary_sel = summary_sel.where(Cat.id.in_(cat_ids))
+        del_summary = del_summary.where(CatSummary.cat_id.in_(cat_ids))
+        del_vaccine = del_vaccine.where(CatVaccineSummary.cat_id.in_(cat_ids))
+
+    conn.execute(del_summary)
+    conn.execute(del_vaccine)
+    conn.execute(insert(CatSummary).from_select(summary_cols, summary_sel))
+    conn.execute(insert(CatVaccineSummary).from_select(vaccine_cols, vaccine_sel))
+
+    # rappels : dérivés des deux résumés qui viennent d'être écrits
+    due_sel = due_reminders_select(cat_ids)
+    del_due = delete(DueReminder)
+    if cat_ids is not None:
+        del_due = del_due.where(DueReminder.cat_id.in_(cat_ids))
+
+    conn.execute(del_due)
+    conn.execute(
+        insert(DueReminder).from_select(
+            ["cat_id", "kind", "vaccine_type_id", "last_date", "next_due"], due_sel
+        )
+    )
+
+
+def data_versions(tables) -> dict:
+    """Versions actuelles des tables demandées (une seule requête)."""
+    rows = (
+        db.session.query(DataVersion.table_name, DataVersion.version)
+        .filter(DataVersion.table_name.in_(tables))
+        .all()
+    )
+    return dict(rows)
+
+
+def versioned_response(tables, build, daily=False):
+    """
+    Réponse GET conditionnelle : ETag fort calculé à partir des versions des
+    `tables` (et de l'URL). Si le client renvoie le même ETag (If-None-Match),
+    on répond 304 sans appeler `build(versions)`.
+    `daily=True` : la réponse dépend aussi de la date du jour (ex : âge).
+    """
+    versions = data_versions(tables)
+    key = [request.full_path, sorted(versions.items())]
+    if daily:
+        key.append(datetime.now(TZ_PARIS).date().isoformat())
+    etag = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = make_response(build(versions))
+        if resp.status_code != 200:
+            return resp
+
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def versioned_etag(*tables, daily=False):
+    """
+    Décorateur : sert l'endpoint via versioned_response (304 avant
+    d'exécuter la moindre requête de l'endpoint si rien n'a changé).
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            return versioned_response(tables, lambda versions: f(*args, **kwargs), daily=daily)
+        return wrapper
+    return decorator
+
+
 def site_protected(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -489,6 +1662,15 @@ def site_protected(f):
             return f(*args, **kwargs)
         return redirect(url_for("login"))
     return wrapper
+
+def api_protected(f):
+    """🔐 Sécurité API : l’utilisateur doit être loggé (401 JSON sinon)."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if session.get("authenticated") is not True:
+            return jsonify({"error": "unauthorized"}), 401
+        return f(*args, **kwargs)
+    return wrapper
 @app.template_filter("age")
 def age_filter(d):
     return age_text(d)
@@ -556,6 +1738,21 @@ def logout():
 # INIT DB (création + données de base)
 # ============================================================
 
+# ➕ Compteurs de versions (ETag des API JSON) : en premier, car toute écriture
+#    ORM des migrations suivantes (ex. catalogue produits) incrémente data_version
+with app.app_context():
+    inspector = inspect(db.engine)
+    if "data_version" not in inspector.get_table_names():
+        print("➡️ Création de la table data_version…")
+        DataVersion.__table__.create(db.engine)
+        print("✅ Table data_version créée.")
+
+    known = {dv.table_name for dv in DataVersion.query.all()}
+    for table_name in db.metadata.tables:
+        if table_name != "data_version" and table_name not in known:
+            db.session.add(DataVersion(table_name=table_name, version=0))
+    db.session.commit()
+
 with app.app_context():
     inspector = inspect(db.engine)
     if "deworming_types" not in inspector.get_table_names():
@@ -584,7 +1781,7 @@ with app.app_context():
 
 with app.app_context():
     inspector = inspect(db.engine)
-    if not inspector.get_table_names():
+    if not set(inspector.get_table_names()) - {"data_version"}:
         db.create_all()
         # Vaccins de base
         for v in ["Typhus", "Coryza", "Leucose"]:
@@ -595,6 +1792,8 @@ with app.app_context():
         # Vétérinaires de base
         for v in ["Dr Dupont", "Dr Martin"]:
             db.session.add(Veterinarian(name=v))
+        # Catalogue du bon de commande
+        db.session.execute(insert(Product), DEFAULT_PRODUCT_ROWS)
         db.session.commit()
         print("✅ Base initialisée.")
 
@@ -615,6 +1814,41 @@ with app.app_context():
         ActivityReport.__table__.create(db.engine)
         print("✅ Table activity_report créée.")
 
+with app.app_context():
+    inspector = inspect(db.engine)
+    cols = [col["name"] for col in inspector.get_columns("activity_report")]
+    if "is_snapshot" not in cols:
+        print("➡️ Ajout colonne is_snapshot (activity_report)…")
+        db.session.execute(db.text(
+            "ALTER TABLE activity_report ADD COLUMN is_snapshot BOOLEAN NOT NULL DEFAULT FALSE"
+        ))
+        db.session.commit()
+        print("✅ Colonne is_snapshot ajoutée.")
+    if "input_hash" not in cols:
+        print("➡️ Ajout colonne input_hash (activity_report)…")
+        db.session.execute(db.text(
+            "ALTER TABLE activity_report ADD COLUMN input_hash VARCHAR(64)"
+        ))
+        db.session.commit()
+        print("✅ Colonne input_hash ajoutée.")
+
+    # Un seul rapport par mois : doublons retirés avant l'index unique (on
+    # garde le rapport validé plutôt que l'instantané, puis le plus ancien)
+    indexes = {ix["name"] for ix in inspector.get_indexes("activity_report")}
+    if "ux_activity_report_year_month" not in indexes:
+        print("➡️ Index unique ux_activity_report_year_month…")
+        db.session.execute(db.text(
+            "DELETE FROM activity_report WHERE id IN ("
+            " SELECT a.id FROM activity_report a JOIN activity_report b"
+            " ON b.year = a.year AND b.month = a.month AND ("
+            "  b.is_snapshot < a.is_snapshot"
+            "  OR (b.is_snapshot = a.is_snapshot AND b.id < a.id)))"
+        ))
+        db.session.commit()
+        for index in ActivityReport.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        print("✅ Index unique créé.")
+
 with app.app_context():
     inspector = inspect(db.engine)
     if "purchase_order" not in inspector.get_table_names():
@@ -622,6 +1856,15 @@ with app.app_context():
         PurchaseOrder.__table__.create(db.engine)
         print("✅ Table purchase_order créée.")
 
+with app.app_context():
+    inspector = inspect(db.engine)
+    if "product" not in inspector.get_table_names():
+        print("➡️ Création de la table product…")
+        Product.__table__.create(db.engine)
+        db.session.execute(insert(Product), DEFAULT_PRODUCT_ROWS)
+        db.session.commit()
+        print(f"✅ Table product créée ({len(DEFAULT_PRODUCTS)} articles).")
+
 with app.app_context():
     inspector = inspect(db.engine)
 
@@ -845,6 +2088,28 @@ with app.app_context():
         ))
         db.session.commit()
         print("✅ Colonne entry_reason ajoutée.")
+
+# ➕ Codes des motifs d'entrée / de sortie (classés une fois avec les règles
+#    des rapports, puis renseignés à chaque saisie) + index (code, date)
+with app.app_context():
+    inspector = inspect(db.engine)
+    cols = [col["name"] for col in inspector.get_columns("cat")]
+
+    for code_col, reason_col, categories in (
+        ("entry_reason_code", Cat.entry_reason, ENTRY_REASON_CODES),
+        ("exit_reason_code", Cat.exit_reason, EXIT_REASON_CODES),
+    ):
+        if code_col not in cols:
+            print(f"➡️ Ajout colonne {code_col}…")
+            db.session.execute(db.text(f"ALTER TABLE cat ADD COLUMN {code_col} VARCHAR(20)"))
+            db.session.execute(
+                update(Cat.__table__).values({code_col: reason_category(reason_col, categories)})
+            )
+            db.session.commit()
+            print(f"✅ Colonne {code_col} ajoutée et remplie.")
+
+    for index in Cat.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
     
 with app.app_context():
     inspector = inspect(db.engine)
@@ -897,6 +2162,114 @@ with app.app_context():
         print("➡️ Création de la table general_appointment…")
         GeneralAppointment.__table__.create(db.engine)
         print("✅ Table general_appointment créée.")
+
+# ➕ Index du calendrier (fenêtre de dates de /api/appointments) + colonnes de
+#    synchro incrémentale (updated_at / deleted_at)
+with app.app_context():
+    inspector = inspect(db.engine)
+    for table_name in ("appointment", "general_appointment"):
+        cols = [col["name"] for col in inspector.get_columns(table_name)]
+        for col in ("updated_at", "deleted_at"):
+            if col not in cols:
+                print(f"➡️ Ajout colonne {col} ({table_name})…")
+                db.session.execute(db.text(f"ALTER TABLE {table_name} ADD COLUMN {col} TIMESTAMP"))
+                db.session.commit()
+                print(f"✅ Colonne {col} ajoutée.")
+
+    # Liens RDV ↔ chats / employés : doublons retirés avant l'index unique
+    # (appointment_id, …), qui remplace l'index simple sur appointment_id
+    for model, column in ((AppointmentCat, "cat_id"), (AppointmentEmployee, "employee_id")):
+        table_name = model.__tablename__
+        indexes = {ix["name"] for ix in inspector.get_indexes(table_name)}
+        if f"ux_{table_name}" not in indexes:
+            print(f"➡️ Index unique ux_{table_name}…")
+            db.session.execute(db.text(
+                f"DELETE FROM {table_name} WHERE id NOT IN "
+                f"(SELECT MIN(id) FROM {table_name} GROUP BY appointment_id, {column})"
+            ))
+            db.session.commit()
+        if f"ix_{table_name}_appointment_id" in indexes:
+            db.session.execute(db.text(f"DROP INDEX ix_{table_name}_appointment_id"))
+            db.session.commit()
+
+    for model in (Appointment, AppointmentCat, AppointmentEmployee, GeneralAppointment):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+# ➕ Récurrence des RDV généraux
+with app.app_context():
+    inspector = inspect(db.engine)
+    cols = [col["name"] for col in inspector.get_columns("general_appointment")]
+    for col, sql_type in (
+        ("recurrence", "VARCHAR(10)"),
+        ("recurrence_interval", "INTEGER NOT NULL DEFAULT 1"),
+        ("recurrence_until", "DATE"),
+        ("recurrence_exceptions", "TEXT"),
+    ):
+        if col not in cols:
+            print(f"➡️ Ajout colonne {col} (general_appointment)…")
+            db.session.execute(db.text(f"ALTER TABLE general_appointment ADD COLUMN {col} {sql_type}"))
+            db.session.commit()
+            print(f"✅ Colonne {col} ajoutée.")
+
+# ➕ Résumés dénormalisés par chat (remplis à la création)
+with app.app_context():
+    inspector = inspect(db.engine)
+    tables = inspector.get_table_names()
+    created = False
+
+    for model in (CatSummary, CatVaccineSummary, DueReminder):
+        if model.__tablename__ not in tables:
+            print(f"➡️ Création de la table {model.__tablename__}…")
+            model.__table__.create(db.engine)
+            created = True
+
+    if created:
+        refresh_cat_summaries(db.session.connection())
+        db.session.commit()
+        print("✅ Résumés par chat et rappels calculés.")
+
+# ➕ Horodatages en TIMESTAMP WITH TIME ZONE. Les anciennes colonnes naïves
+#    n'ont pas toutes le même fuseau :
+#    - RDV (date, start/end, updated_at/deleted_at) : heure de Paris naïve
+#      saisie dans les formulaires ou paris_now() ;
+#    - les autres (notes, tâches, rapports…) recevaient datetime.now(TZ_PARIS),
+#      que PostgreSQL convertissait dans le fuseau de la session (celui du
+#      serveur, UTC par défaut : LEGACY_DB_TIMEZONE) avant de l'enregistrer.
+PARIS_WALL_TIME_COLUMNS = {
+    ("appointment", "date"),
+    ("appointment", "updated_at"),
+    ("appointment", "deleted_at"),
+    ("general_appointment", "start"),
+    ("general_appointment", "end"),
+    ("general_appointment", "updated_at"),
+    ("general_appointment", "deleted_at"),
+}
+LEGACY_DB_TIMEZONE = os.environ.get("LEGACY_DB_TIMEZONE", "UTC")
+
+with app.app_context():
+    if db.engine.dialect.name == "postgresql":
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            current = {col["name"]: col["type"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if not isinstance(column.type, ParisDateTime) or column.name not in current:
+                    continue
+                if getattr(current[column.name], "timezone", False):
+                    continue
+                if (table.name, column.name) in PARIS_WALL_TIME_COLUMNS:
+                    source_tz = "Europe/Paris"
+                else:
+                    source_tz = LEGACY_DB_TIMEZONE
+                print(f"➡️ {table.name}.{column.name} ({source_tz}) → TIMESTAMP WITH TIME ZONE…")
+                ZoneInfo(source_tz)   # nom de fuseau valide (inséré tel quel dans le DDL)
+                db.session.execute(db.text(
+                    f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" '
+                    f'TYPE TIMESTAMP WITH TIME ZONE '
+                    f'USING "{column.name}" AT TIME ZONE \'{source_tz}\''
+                ))
+                db.session.commit()
+                print(f"✅ {table.name}.{column.name} converti.")
         
 # ============================================================
 # STATIC UPLOADS
@@ -1102,12 +2475,44 @@ def appointment_delete(appointment_id):
     AppointmentCat.query.filter_by(appointment_id=appointment_id).delete()
     AppointmentEmployee.query.filter_by(appointment_id=appointment_id).delete()
 
-    db.session.delete(appointment)
+    # suppression logique : le calendrier doit pouvoir la retirer (updated_since)
+    appointment.deleted_at = paris_now()
     db.session.commit()
 
     return redirect(url_for("appointments_page"))
 
 
+# -------------------- Liens RDV ↔ chats / employés --------------------
+def existing_ids(model, raw_ids) -> set:
+    """Ids du formulaire qui existent dans `model`, vérifiés en une requête IN."""
+    ids = {int(v) for v in raw_ids if v.strip().isdigit()}
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+
+def sync_appointment_links(appointment_id, link_model, column, wanted: set) -> bool:
+    """
+    Aligne les liens d'un RDV sur `wanted` par différence : un DELETE pour les
+    ids retirés, un INSERT groupé pour les ajoutés (nombre de requêtes
+    constant, quel que soit le nombre de chats). Renvoie True si ça a changé.
+    """
+    current = set(db.session.scalars(
+        select(column).where(link_model.appointment_id == appointment_id)
+    ))
+    removed, added = current - wanted, wanted - current
+    if removed:
+        db.session.execute(
+            delete(link_model)
+            .where(link_model.appointment_id == appointment_id, column.in_(removed))
+        )
+    if added:
+        db.session.execute(
+            insert(link_model),
+            [{"appointment_id": appointment_id, column.key: v} for v in sorted(added)],
+        )
+    return bool(removed or added)
+
 
 @app.route("/appointments/<int:appointment_id>/edit", methods=["POST"])
 @site_protected
@@ -1118,23 +2523,23 @@ def appointment_update(appointment_id):
     date_str = request.form.get("date")
     if date_str:
         dt = datetime.strptime(date_str, "%Y-%m-%dT%H:%M")
-        # ❌ pas de dt.replace(tzinfo=TZ_PARIS) ici
+        # heure de Paris saisie : ParisDateTime y attache le fuseau
         appt.date = dt
 
     appt.location = request.form.get("location") or "Rendez-vous"
-    
-    # Reset les chats
-    AppointmentCat.query.filter_by(appointment_id=appointment_id).delete()
-    for cid in request.form.getlist("cats[]"):
-        if cid.isdigit():
-            db.session.add(AppointmentCat(appointment_id=appointment_id, cat_id=int(cid)))
 
-    # Reset les employés
-    AppointmentEmployee.query.filter_by(appointment_id=appointment_id).delete()
-    for eid in request.form.getlist("employees[]"):
-        if eid.isdigit():
-            db.session.add(AppointmentEmployee(appointment_id=appointment_id, employee_id=int(eid)))
+    # Chats / employés : seuls les liens ajoutés ou retirés sont écrits
+    sync_appointment_links(
+        appointment_id, AppointmentCat, AppointmentCat.cat_id,
+        existing_ids(Cat, request.form.getlist("cats[]")),
+    )
+    sync_appointment_links(
+        appointment_id, AppointmentEmployee, AppointmentEmployee.employee_id,
+        existing_ids(Employee, request.form.getlist("employees[]")),
+    )
 
+    # chats / employés changés sans toucher la ligne : on la date quand même
+    appt.updated_at = paris_now()
     db.session.commit()
     return redirect(url_for("appointments_page"))
 
@@ -1162,11 +2567,12 @@ def general_appointment_update(appointment_id):
     start = parse_date_optional_time(start_str)
     end = parse_date_optional_time(end_str)
 
-    # ❌ plus de .replace(tzinfo=TZ_PARIS) avant stockage
     appt.start = start
     appt.end = end
+    apply_recurrence_form(appt, request.form)
 
     db.session.commit()
+    recurrence_cache.forget(appt.id)
     return redirect(url_for("appointments_page"))
 
 @app.post("/cats/<int:cat_id>/weights/<int:weight_id>/delete")
@@ -1194,6 +2600,7 @@ def cat_exit(cat_id):
         cat.exit_date = datetime.strptime(exit_date, "%Y-%m-%d").date()
 
     cat.exit_reason = exit_reason
+    cat.exit_reason_code = reason_code(exit_reason, EXIT_REASON_CODES)
 
     # Par défaut, on vide les infos adoptant
     cat.adopter_name = None
@@ -1227,6 +2634,7 @@ def cat_cancel_exit(cat_id):
     # On supprime les infos de sortie
     cat.exit_date = None
     cat.exit_reason = None
+    cat.exit_reason_code = None
     
     # On supprime aussi les infos adoptant
     cat.adopter_name = None
@@ -1246,8 +2654,10 @@ def cat_cancel_exit(cat_id):
 @site_protected
 def general_appointment_delete(appointment_id):
     appt = GeneralAppointment.query.get_or_404(appointment_id)
-    db.session.delete(appt)
+    # suppression logique : le calendrier doit pouvoir la retirer (updated_since)
+    appt.deleted_at = paris_now()
     db.session.commit()
+    recurrence_cache.forget(appt.id)
     return redirect(url_for("appointments_page"))
 
 # (reste du fichier)
@@ -1257,70 +2667,157 @@ def index():
     return redirect(url_for("cats"))
     
 # -------------------- Helpers dashboard --------------------
-def compute_vaccines_due(days: int = 30):
-    today = date.today()
-    limit = today + timedelta(days=days)
-    results = []
+class FragmentCache:
+    """
+    Fragments HTML du tableau de bord gardés en mémoire (par process).
+    Une entrée par panneau, clé = versions des tables qui l'alimentent +
+    date du jour : une écriture sur une autre table ne l'invalide pas.
+    """
 
-    vaccine_types = VaccineType.query.all()
-    cats = Cat.query.filter(
-        db.or_(
+    def __init__(self):
+        self.entries = {}
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def get_or_render(self, name, panel, versions):
+        key = (
+            tuple(versions.get(t, 0) for t in panel["tables"]),
+            # date de Paris : le fragment change à minuit (heure de Paris)
+            datetime.now(TZ_PARIS).date(),
+        )
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == key:
+            with self.lock:
+                self.hits[name] = self.hits.get(name, 0) + 1
+            return entry[1]
+
+        html = Markup(render_template(panel["template"], **panel["context"]()))
+        with self.lock:
+            self.entries[name] = (key, html)
+            self.misses[name] = self.misses.get(name, 0) + 1
+        return html
+
+    def stats(self):
+        return {
+            name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0)}
+            for name in DASHBOARD_PANELS
+        }
+
+
+dashboard_cache = FragmentCache()
+
+
+def dashboard_stats_context():
+    vaccines_due = compute_vaccines_due(30)
+    dewormings_due = compute_dewormings_due(7)
+
+    return {
+        "total_cats": Cat.query.filter(
             Cat.exit_date.is_(None),
-            Cat.status == "famille d'accueil"
-        ),
-        Cat.status.notin_(["adopté", "décédé"])
-    ).all()
+            Cat.status.notin_(["adopté", "décédé", "famille d'accueil"])
+        ).count(),
+        "total_appointments": Appointment.query.count(),
+        "tasks_pending_count": CatTask.query.filter_by(is_done=False).count(),
+        "vaccines_late_count": sum(1 for v in vaccines_due if v["status"] == "late"),
+        "vaccines_due_count": sum(1 for v in vaccines_due if v["status"] == "soon"),
+        "deworm_late_count": sum(1 for d in dewormings_due if d["status"] == "late"),
+        "deworm_due_count": sum(1 for d in dewormings_due if d["status"] == "soon"),
+    }
 
-    for cat in cats:
 
-        # Récupère la dernière injection par type
-        last_by_type = {}
-        for v in cat.vaccinations:
-            vt = v.vaccine_type_id
-            if vt not in last_by_type or v.date > last_by_type[vt].date:
-                last_by_type[vt] = v
+def dashboard_tasks_context():
+    return {
+        "cats": Cat.query.filter(
+            Cat.exit_date.is_(None),
+            Cat.status.notin_(["adopté", "décédé", "famille d'accueil"])
+        ).options(
+            db.selectinload(Cat.tasks).joinedload(CatTask.task_type)
+        ).order_by(Cat.name).all(),
+        "veterinarians": Veterinarian.query.all(),
+    }
 
-        # Pour chaque type de vaccin, on calcule le prochain rappel
-        for vt in vaccine_types:
-            vt_id = vt.id
 
-            if vt_id not in last_by_type:
-                continue
+# Panneaux du tableau de bord : gabarit, tables sources (invalidation) et
+# contexte calculé uniquement quand le fragment doit être rendu.
+DASHBOARD_PANELS = {
+    "stats": {
+        "template": "dashboard/_stats.html",
+        "tables": ("cat", "appointment", "cat_task", "vaccination", "vaccine_type", "deworming"),
+        "context": dashboard_stats_context,
+    },
+    "vaccines": {
+        "template": "dashboard/_vaccines.html",
+        "tables": ("cat", "vaccination", "vaccine_type"),
+        "context": lambda: {"vaccines_due": compute_vaccines_due(30)},
+    },
+    "deworm_group": {
+        "template": "dashboard/_deworm_group.html",
+        "tables": ("deworming",),
+        "context": lambda: {"deworm_group": compute_deworming_group_reminder()},
+    },
+    "tasks": {
+        "template": "dashboard/_tasks.html",
+        "tables": ("cat", "cat_task", "task_type", "veterinarian"),
+        "context": dashboard_tasks_context,
+    },
+    "deworm_modals": {
+        "template": "dashboard/_deworm_modals.html",
+        "tables": ("cat", "deworming"),
+        "context": lambda: {"dewormings_due": compute_dewormings_due(7)},
+    },
+}
+
+
+PRESENT_CAT_FILTER = (
+    db.or_(
+        Cat.exit_date.is_(None),
+        Cat.status == "famille d'accueil"
+    ),
+    Cat.status.notin_(["adopté", "décédé"]),
+)
+
+
+def vaccines_due_query(reminders, limit: date):
+    """
+    Rappels de vaccin des chats présents à partir de `reminders` (colonnes
+    cat_id, vaccine_type_id, last_date, next_due) : seules les lignes dont le
+    rappel tombe avant `limit` (retards compris) sont renvoyées.
+    """
+    return (
+        db.session.query(Cat, VaccineType, reminders.c.last_date, reminders.c.next_due)
+        .select_from(reminders)
+        .join(Cat, Cat.id == reminders.c.cat_id)
+        .join(VaccineType, VaccineType.id == reminders.c.vaccine_type_id)
+        .filter(*PRESENT_CAT_FILTER, reminders.c.next_due <= limit)
+    )
 
-            last_vacc = last_by_type[vt_id]
 
-            # Primo = rappel 30 jours sinon 1 an
-            if last_vacc.primo:
-                next_due = last_vacc.date + timedelta(days=30)
-            else:
-                next_due = last_vacc.date + timedelta(days=365)
+def compute_vaccines_due(days: int = 30):
+    today = date.today()
+    limit = today + timedelta(days=days)
+    results = []
 
-            days_left = (next_due - today).days
+    # Rappels lus dans due_reminders (tenue à jour à chaque écriture) ;
+    # seuls les rappels en retard ou à venir sortent de la base.
+    reminders = (
+        select(DueReminder.cat_id, DueReminder.vaccine_type_id, DueReminder.last_date, DueReminder.next_due)
+        .where(DueReminder.kind == "vaccine")
+        .subquery()
+    )
+    for cat, vt, last_date, next_due in vaccines_due_query(reminders, limit):
+        days_left = (next_due - today).days
 
-            # En retard
-            if next_due < today:
-                results.append({
-                    "cat": cat,
-                    "vaccine": vt,
-                    "last_date": last_vacc.date,
-                    "next_due": next_due,
-                    "days_left": days_left,
-                    "status": "late"
-                })
-                continue
+        results.append({
+            "cat": cat,
+            "vaccine": vt,
+            "last_date": last_date,
+            "next_due": next_due,
+            "days_left": days_left,
+            "status": "late" if next_due < today else "soon",
+        })
 
-            # À venir dans X jours
-            if today <= next_due <= limit:
-                results.append({
-                    "cat": cat,
-                    "vaccine": vt,
-                    "last_date": last_vacc.date,
-                    "next_due": next_due,
-                    "days_left": days_left,
-                    "status": "soon"
-                })
-
-        # tri par urgence
+    # tri par urgence
     results.sort(key=lambda x: (
         0 if x["status"] == "late" else 1,
         x["days_left"]
@@ -1329,6 +2826,20 @@ def compute_vaccines_due(days: int = 30):
     return results
 
 
+def dewormings_due_query(reminders, limit: date):
+    """
+    Rappels de vermifuge des chats présents à partir de `reminders` (colonnes
+    cat_id, last_date, next_due) : seules les lignes dont le rappel tombe
+    avant `limit` (retards compris) sont renvoyées.
+    """
+    return (
+        db.session.query(Cat, reminders.c.last_date, reminders.c.next_due)
+        .select_from(reminders)
+        .join(Cat, Cat.id == reminders.c.cat_id)
+        .filter(*PRESENT_CAT_FILTER, reminders.c.next_due <= limit)
+    )
+
+
 def compute_dewormings_due(days: int = 7):
     """
     Rappels de vermifuge PAR CHAT :
@@ -1339,46 +2850,23 @@ def compute_dewormings_due(days: int = 7):
     limit = today + timedelta(days=days)
     results = []
 
-    # Chats présents ou en famille d'accueil, hors adoptés/décédés
-    cats = Cat.query.filter(
-        db.or_(
-            Cat.exit_date.is_(None),
-            Cat.status == "famille d'accueil"
-        ),
-        Cat.status.notin_(["adopté", "décédé"])
-    ).all()
-
-    for cat in cats:
-        if not cat.dewormings:
-            continue
-
-        # Dernier vermifuge de ce chat
-        last_deworm = max(cat.dewormings, key=lambda d: d.date)
+    # Rappels lus dans due_reminders (tenue à jour à chaque écriture)
+    reminders = (
+        select(DueReminder.cat_id, DueReminder.last_date, DueReminder.next_due)
+        .where(DueReminder.kind == "deworming")
+        .subquery()
+    )
 
-        # Rappel toutes les 8 semaines (2 mois)
-        next_due = last_deworm.date + relativedelta(months=2)
+    for cat, last_date, next_due in dewormings_due_query(reminders, limit):
         days_left = (next_due - today).days
 
-        # En retard
-        if next_due < today:
-            results.append({
-                "cat": cat,
-                "last_date": last_deworm.date,
-                "next_due": next_due,
-                "days_left": days_left,
-                "status": "late",
-            })
-            continue
-
-        # À venir dans X jours
-        if today <= next_due <= limit:
-            results.append({
-                "cat": cat,
-                "last_date": last_deworm.date,
-                "next_due": next_due,
-                "days_left": days_left,
-                "status": "soon",
-            })
+        results.append({
+            "cat": cat,
+            "last_date": last_date,
+            "next_due": next_due,
+            "days_left": days_left,
+            "status": "late" if next_due < today else "soon",
+        })
 
     # tri par urgence
     results.sort(key=lambda x: (
@@ -1392,70 +2880,35 @@ def compute_dewormings_due(days: int = 7):
 @app.route("/dashboard")
 @site_protected
 def dashboard():
+    # Coquille seule : chaque panneau est chargé en parallèle par le
+    # navigateur depuis /dashboard/panels/<nom>.
+    return render_template("dashboard.html", calendar_sync_since=paris_now().isoformat())
 
-    # ------------------ Vaccins ------------------
-    vaccines_due = compute_vaccines_due(30)
-    vaccines_late_count = sum(1 for v in vaccines_due if v["status"] == "late")
-    vaccines_due_count  = sum(1 for v in vaccines_due if v["status"] == "soon")
 
-    # ------------------ Vermifuges (individuels) ------------------
-    dewormings_due = compute_dewormings_due(7)
-    deworm_late_count = sum(1 for d in dewormings_due if d["status"] == "late")
-    deworm_due_count  = sum(1 for d in dewormings_due if d["status"] == "soon")
-
-    # ------------------ Vermifuges (groupé) ------------------
-    deworm_group = compute_deworming_group_reminder()
-
-    # ------------------ Stats ------------------
-    stats = {
-        "cats": Cat.query.filter(
-            Cat.exit_date.is_(None),
-            Cat.status.notin_(["adopté", "décédé", "famille d'accueil"])
-        ).count(),
-        "appointments": Appointment.query.count(),
-        "employees": Employee.query.count(),
-    }
-
-    tasks_pending_count = CatTask.query.filter_by(is_done=False).count()
-    employees = Employee.query.order_by(Employee.name.asc()).all()
-
-    return render_template(
-        "dashboard.html",
-
-        # --- stats génériques ---
-        stats=stats,
-        total_cats=stats["cats"],
-        total_appointments=stats["appointments"],
-        total_employees=stats["employees"],
-        tasks_pending_count=tasks_pending_count,
-
-        # --- vaccins ---
-        vaccines_due=vaccines_due,
-        vaccines_late_count=vaccines_late_count,
-        vaccines_due_count=vaccines_due_count,
-
-        # --- vermifuges ---
-        # cartes de gauche = par chat
-        deworm_late_count=deworm_late_count,
-        deworm_due_count=deworm_due_count,
-        # bloc central = groupé
-        deworm_group=deworm_group,
-        # on passe aussi la liste détaillée pour un futur hover
-        dewormings_due=dewormings_due,
-
-        # --- contenu pour le dashboard ---
-        cats=Cat.query.filter(
-            Cat.exit_date.is_(None),
-            Cat.status.notin_(["adopté", "décédé", "famille d'accueil"])
-        ).order_by(Cat.name).all(),
-        employees=employees,
-        veterinarians=Veterinarian.query.all(),
+@app.route("/dashboard/panels/<name>")
+@site_protected
+def dashboard_panel(name):
+    """Fragment HTML d'un panneau du tableau de bord (ETag + Server-Timing)."""
+    panel = DASHBOARD_PANELS.get(name)
+    if panel is None:
+        return "Panneau inconnu", 404
+
+    t0 = time.perf_counter()
+    resp = versioned_response(
+        panel["tables"],
+        lambda versions: dashboard_cache.get_or_render(name, panel, versions),
+        daily=True,
     )
+    elapsed = (time.perf_counter() - t0) * 1000
+    resp.headers["Server-Timing"] = f'panel;dur={elapsed:.1f};desc="{name}"'
+    return resp
 
 
-
-
-
+@app.route("/api/dashboard_cache")
+@api_protected
+def api_dashboard_cache():
+    """Compteurs hits / misses du cache des fragments du tableau de bord."""
+    return jsonify(dashboard_cache.stats())
 
 
 @app.route("/recherche")
@@ -1467,7 +2920,7 @@ def recherche():
 @app.route("/calendrier")
 @site_protected
 def calendrier():
-    return render_template("calendrier.html")
+    return render_template("calendrier.html", calendar_sync_since=paris_now().isoformat())
 
 
 @app.route("/cats")
@@ -1565,39 +3018,12 @@ def cats():
 @app.route("/documents")
 @site_protected
 def documents():
-    # Liste des produits (PDF importé)
-    products = [
-        ("1000006", "Bidon 5L détergent bactéricide flash DP pin"),
-        ("1000005", "Bidon 5L détergent bactéricide flash DP citron"),
-        ("1000108", "Pulvérisateur 750ml dégraissant virucide IDOS"),
-        ("002023104", "Bidon 1L détergent vaisselle"),
-        ("002020105", "Bidon 5L lessive liquide enzymes"),
-        ("123919", "Bidon 5L eau de javel 9.6°"),
-        ("002026002", "Pousse mousse savon mains 500ml"),
-        ("002061495", "Pulvérisateur 750ml nettoyant vitres"),
-        ("022207001", "Bidon 5L vinaigre ecocert"),
-        ("1000126", "Flacon 750ml WC gel gely bact"),
-        ("124097", "Carton 500 SAD 50L blancs"),
-        ("124858", "Carton 100 SAD 160L 55mm"),
-        ("124056", "Carton 500 SAD 30L corbeilles"),
-        ("132266", "Gant MAPA S-M-L-XL"),
-        ("1052", "Boîte 100 gants jetables latex S-M-L-XL"),
-        ("1082", "Boîte 100 gants jetables nitrile bleu S-M-L-XL"),
-        ("T376", "Paquet 10 éponges double face vert"),
-        ("00HE44", "Paquet 10 éponges n°4"),
-        ("2501003101", "Paquet 10 éponges magiques"),
-        ("T184", "Sachet 5 lavettes microfibre"),
-        ("T117", "Paquet 10 éponges inox"),
-        ("0702070", "Seau essoreur pour frange espagnol"),
-        ("1261", "Frange espagnol microfibre bleue"),
-        ("406900", "Colis 72 rouleaux papier toilette"),
-        ("416895", "Colis 6 bobines dévidage central"),
-        ("0212700001", "Aspirateur poussière"),
-        ("022000730", "Lot 20 sacs aspirateur"),
-    ]
+    products = purchase_order_products()
 
     # Historique des rapports d'activité déjà générés
-    reports = ActivityReport.query.order_by(
+    reports = ActivityReport.query.filter(
+        ActivityReport.is_snapshot.is_(False)
+    ).order_by(
         ActivityReport.year.desc(),
         ActivityReport.month.desc()
     ).all()
@@ -1612,78 +3038,14 @@ def documents():
         "documents.html",
         products=products,
         reports=reports,
-        orders=orders
+        orders=orders,
+        current_year=date.today().year,
+        pdf_job_id=request.args.get("job"),
     )
 
-@app.route("/documents/activity_report/generate", methods=["POST"])
-@site_protected
-def generate_activity_report():
-    import io
-    import os
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.colors import black, blue, white
-    from reportlab.lib.enums import TA_RIGHT, TA_LEFT
-    from reportlab.platypus import Paragraph
-    from reportlab.lib.styles import getSampleStyleSheet
-    from datetime import datetime
-
-    # ---------------------------------------------------------
-    # UTILITAIRE : texte multi-ligne centré verticalement
-    # ---------------------------------------------------------
-    def draw_multiline_text(canvas, text, x, y, width, height,
-                            align=TA_LEFT, font_name="Helvetica",
-                            font_size=12, color=black):
-        styles = getSampleStyleSheet()
-        style = styles['Normal']
-        style.fontName = font_name
-        style.fontSize = font_size
-        style.textColor = color
-        style.alignment = align
-
-        p = Paragraph(text, style)
-        p_width, p_height = p.wrapOn(canvas, width, height)
-        y_offset = (height - p_height) / 2
-        p.drawOn(canvas, x, y + y_offset)
-
-    # ---------------------------------------------------------
-    # RÉCUP PARAMÈTRES
-    # ---------------------------------------------------------
-    try:
-        year = int(request.form.get("year"))
-        month = int(request.form.get("month"))
-    except:
-        year = datetime.now().year
-        month = datetime.now().month
-
-    fields = [
-        "entries_abandon", "entries_return", "entries_found", "entries_total",
-        "count_start",
-        "exits_placed", "exits_returned_owner", "exits_deceased",
-        "exits_escaped", "exits_transferred", "exits_total", "count_end",
-    ]
-    counts = {f: int(request.form.get(f, 0) or 0) for f in fields}
-
-    # ---------------------------------------------------------
-    # ESPÈCES (autres que chats) — cohérent avec confirmation.html
-    # ---------------------------------------------------------
-    species_start = []
-    for i in range(1, 5):
-        name = request.form.get(f"species{i}_name", "").strip()
-        count = request.form.get(f"species{i}_count", "").strip()
-        if name and count and count != "0":
-            species_start.append({"name": name, "count": int(count)})
-
-    species_end = []
-    for i in range(1, 5):
-        name = request.form.get(f"species{i}_name_end", "").strip()
-        count = request.form.get(f"species{i}_count_end", "").strip()
-        if name and count and count != "0":
-            species_end.append({"name": name, "count": int(count)})
-
-    if not species_end:
-        species_end = list(species_start)
-
+def render_activity_report_pdf(out, year: int, month: int, counts: dict,
+                               species_start: list, species_end: list):
+    """PDF du rapport d'activité mensuel (une page A4), écrit dans le fichier `out`."""
     # chats début / fin
     chats_start = counts.get("count_start", 0)
     chats_end = counts.get("count_end", 0)
@@ -1695,18 +3057,12 @@ def generate_activity_report():
     # ---------------------------------------------------------
     # MOIS FORMATÉ
     # ---------------------------------------------------------
-    month_names = {
-        1: "JANVIER", 2: "FÉVRIER", 3: "MARS", 4: "AVRIL",
-        5: "MAI", 6: "JUIN", 7: "JUILLET", 8: "AOÛT",
-        9: "SEPTEMBRE", 10: "OCTOBRE", 11: "NOVEMBRE", 12: "DÉCEMBRE",
-    }
-    title_month = f"{month_names.get(month, '').upper()} {year}"
+    title_month = f"{MONTH_NAMES_UPPER.get(month, '').upper()} {year}"
 
     # ---------------------------------------------------------
     # INIT PDF
     # ---------------------------------------------------------
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
+    c = canvas.Canvas(out, pagesize=A4)
     width, height = A4
 
     margin_left = 40
@@ -1715,15 +3071,15 @@ def generate_activity_report():
     # ---------------------------------------------------------
     # LOGO
     # ---------------------------------------------------------
-    logo_path = os.path.join(app.static_folder, "logo_faa.png")
+    logo = pdf_logo()
     logo_w = 150
     logo_h = 100
     logo_x = margin_left
     logo_y = height - 10 - logo_h
 
-    if os.path.exists(logo_path):
+    if logo is not None:
         c.drawImage(
-            logo_path, logo_x, logo_y,
+            logo, logo_x, logo_y,
             width=logo_w, height=logo_h,
             preserveAspectRatio=True, mask="auto"
         )
@@ -1832,23 +3188,23 @@ def generate_activity_report():
             for sp in species_end:
                 right_text += f"<br/>{sp['name']} : {sp['count']}"
 
-            draw_multiline_text(c, left_text, left_x_label, line_y,
+            pdf_text_in_box(c, left_text, left_x_label, line_y,
                                 col_width - 20, row_h, TA_LEFT,
                                 font_style, font_size, text_color)
-            draw_multiline_text(c, right_text, right_x_label, line_y,
+            pdf_text_in_box(c, right_text, right_x_label, line_y,
                                 col_width - 20, row_h, TA_LEFT,
                                 font_style, font_size, text_color)
         else:
             # lignes normales
             e_label, e_key = entries_rows[i]
             if e_label:
-                draw_multiline_text(
+                pdf_text_in_box(
                     c, f"{e_label} :", left_x_label, line_y,
                     label_width, row_h, TA_LEFT,
                     font_style, font_size, text_color
                 )
                 val = counts.get(e_key, 0) if e_key else ""
-                draw_multiline_text(
+                pdf_text_in_box(
                     c, str(val), col_split_x - 50, line_y,
                     40, row_h, TA_RIGHT,
                     font_style, font_size, text_color
@@ -1856,13 +3212,13 @@ def generate_activity_report():
 
             s_label, s_key = sorties_rows[i]
             if s_label:
-                draw_multiline_text(
+                pdf_text_in_box(
                     c, f"{s_label} :", right_x_label, line_y,
                     label_width, row_h, TA_LEFT,
                     font_style, font_size, text_color
                 )
                 val = counts.get(s_key, 0) if s_key else ""
-                draw_multiline_text(
+                pdf_text_in_box(
                     c, str(val), table_x + table_width - 50,
                     line_y, 40, row_h, TA_RIGHT,
                     font_style, font_size, text_color
@@ -1886,21 +3242,46 @@ def generate_activity_report():
     # ---------------------------------------------------------
     c.showPage()
     c.save()
-    buffer.seek(0)
 
-    # ---------------------------------------------------------
-    # SAVE + DB
-    # ---------------------------------------------------------
-    reports_folder = os.path.join(app.config["UPLOAD_FOLDER"], "reports")
-    os.makedirs(reports_folder, exist_ok=True)
 
-    filename = f"Rapport d'activité {month_names[month].capitalize()} {year}.pdf"
-    file_path = os.path.join(reports_folder, filename)
+def activity_report_hash(year, month, counts, species_start, species_end):
+    """Empreinte SHA-256 de tout ce qui est imprimé dans le rapport d'activité."""
+    payload = {
+        "year": year,
+        "month": month,
+        "counts": {f: counts.get(f, 0) for f in ACTIVITY_COUNT_FIELDS},
+        "species_start": species_start,
+        "species_end": species_end,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
 
-    with open(file_path, "wb") as f:
-        f.write(buffer.getvalue())
 
+def activity_report_cached_file(year, month, input_hash):
+    """(rapport, chemin du PDF) si le PDF enregistré a la même empreinte, sinon (rapport, None)."""
     report = ActivityReport.query.filter_by(year=year, month=month).first()
+    if not report or report.input_hash != input_hash or not report.pdf_filename:
+        return report, None
+    file_path = os.path.join(app.config["UPLOAD_FOLDER"], "reports", report.pdf_filename)
+    return report, (file_path if os.path.exists(file_path) else None)
+
+
+def build_activity_report(year, month, counts, species_start, species_end):
+    """Job : rend le rapport d'activité, l'écrit dans uploads/reports et l'enregistre."""
+    input_hash = activity_report_hash(year, month, counts, species_start, species_end)
+
+    # un autre worker / job a pu produire le même PDF entre-temps
+    report, cached_path = activity_report_cached_file(year, month, input_hash)
+    if cached_path:
+        return {"folder": "reports", "filename": report.pdf_filename, "download_name": report.pdf_filename}
+
+    filename = f"Rapport d'activité {MONTH_NAMES_UPPER[month].capitalize()} {year}.pdf"
+    write_pdf_atomic(
+        os.path.join(app.config["UPLOAD_FOLDER"], "reports"), filename,
+        lambda out: render_activity_report_pdf(out, year, month, counts, species_start, species_end),
+    )
+
     if not report:
         report = ActivityReport(year=year, month=month)
         db.session.add(report)
@@ -1909,42 +3290,145 @@ def generate_activity_report():
         setattr(report, k, v)
 
     report.pdf_filename = filename
+    report.input_hash = input_hash
+    report.is_snapshot = False
     report.updated_at = datetime.now(TZ_PARIS)
     if not report.created_at:
         report.created_at = datetime.now(TZ_PARIS)
 
     db.session.commit()
+    return {"folder": "reports", "filename": filename, "download_name": filename}
 
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/pdf"
+
+def build_purchase_order(quantities):
+    """Job : rend le bon de commande, l'écrit dans uploads/orders et l'enregistre."""
+    now_ts = datetime.now(TZ_PARIS)
+    products = purchase_order_products()
+
+    filename = f"bon_de_commande_{now_ts.strftime('%Y%m%d_%H%M%S')}.pdf"
+    display_name = f"Bon de commande IDF {now_ts.strftime('%d.%m.%y')}.pdf"
+    write_pdf_atomic(
+        os.path.join(app.config["UPLOAD_FOLDER"], "orders"), filename,
+        lambda out: render_purchase_order_pdf(out, products, quantities, now_ts),
+    )
+
+    # Enregistrement en base pour l'historique
+    po = PurchaseOrder(
+        order_date=now_ts.date(),
+        pdf_filename=filename,
+        created_at=now_ts
     )
+    db.session.add(po)
+    db.session.commit()
+    return {"folder": "orders", "filename": filename, "download_name": display_name}
+
 
+def pdf_job_response(job_id):
+    """202 + id du job pour un appel fetch, sinon retour aux documents qui suivent le job."""
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({
+            "job_id": job_id,
+            "status_url": url_for("pdf_job_status", job_id=job_id),
+        }), 202
+    return redirect(url_for("documents", job=job_id))
 
 
+@app.route("/documents/jobs/<job_id>")
+@site_protected
+def pdf_job_status(job_id):
+    job = pdf_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job inconnu"}), 404
 
+    payload = {"job_id": job_id, "kind": job["kind"], "status": job["status"]}
+    if job["status"] == "error":
+        payload["error"] = job["error"]
+    if job["status"] == "done":
+        payload["download_url"] = url_for("pdf_job_download", job_id=job_id)
+    return jsonify(payload)
 
 
+@app.route("/documents/jobs/<job_id>/download")
+@site_protected
+def pdf_job_download(job_id):
+    job = pdf_jobs.get(job_id)
+    if job is None or job["status"] != "done":
+        return jsonify({"error": "PDF pas encore disponible"}), 404
 
+    file_path = os.path.join(app.config["UPLOAD_FOLDER"], job["folder"], job["filename"])
+    if not os.path.exists(file_path):
+        return jsonify({"error": "fichier PDF introuvable"}), 404
 
+    return send_pdf(file_path, download_name=job["download_name"])
+
+
+@app.route("/documents/activity_report/generate", methods=["POST"])
+@site_protected
+def generate_activity_report():
+    # ---------------------------------------------------------
+    # RÉCUP PARAMÈTRES
+    # ---------------------------------------------------------
+    try:
+        year = int(request.form.get("year"))
+        month = int(request.form.get("month"))
+    except:
+        year = datetime.now().year
+        month = datetime.now().month
+
+    counts = {f: int(request.form.get(f, 0) or 0) for f in ACTIVITY_COUNT_FIELDS}
+
+    # ---------------------------------------------------------
+    # ESPÈCES (autres que chats) — cohérent avec confirmation.html
+    # ---------------------------------------------------------
+    species_start = []
+    for i in range(1, 5):
+        name = request.form.get(f"species{i}_name", "").strip()
+        count = request.form.get(f"species{i}_count", "").strip()
+        if name and count and count != "0":
+            species_start.append({"name": name, "count": int(count)})
+
+    species_end = []
+    for i in range(1, 5):
+        name = request.form.get(f"species{i}_name_end", "").strip()
+        count = request.form.get(f"species{i}_count_end", "").strip()
+        if name and count and count != "0":
+            species_end.append({"name": name, "count": int(count)})
+
+    if not species_end:
+        species_end = list(species_start)
+
+    # Mêmes données que le PDF enregistré : on le renvoie tel quel
+    input_hash = activity_report_hash(year, month, counts, species_start, species_end)
+    report, cached_path = activity_report_cached_file(year, month, input_hash)
+    if cached_path:
+        return send_pdf(cached_path, download_name=report.pdf_filename)
+
+    job_id = pdf_jobs.submit(
+        "activity_report", build_activity_report,
+        year, month, counts, species_start, species_end,
+    )
+    return pdf_job_response(job_id)
 
 
- 
 @app.route("/documents/activity_report/<int:year>/<int:month>")
 @site_protected
 def activity_report_download(year, month):
-    report = ActivityReport.query.filter_by(year=year, month=month).first_or_404()
+    # un instantané annuel seul (is_snapshot, sans PDF) n'a rien à télécharger
+    report = ActivityReport.query.filter(
+        ActivityReport.year == year,
+        ActivityReport.month == month,
+        ActivityReport.is_snapshot.is_(False),
+        ActivityReport.pdf_filename.isnot(None),
+    ).first_or_404()
 
     reports_folder = os.path.join(app.config["UPLOAD_FOLDER"], "reports")
-    file_path = os.path.join(reports_folder, report.pdf_filename or "")
+    file_path = os.path.join(reports_folder, report.pdf_filename)
 
-    if not os.path.exists(file_path):
+    if not os.path.isfile(file_path):
         flash("Le fichier PDF de ce rapport est introuvable sur le serveur.", "danger")
         return redirect(url_for("documents"))
 
-    return send_file(file_path, as_attachment=False)
+    return send_pdf(file_path)
 
 @app.post("/documents/activity_report/confirm")
 @site_protected
@@ -1955,23 +3439,8 @@ def activity_report_confirm():
     # ----------------------------
     # Champs numériques standard
     # ----------------------------
-    fields = [
-        "entries_abandon",
-        "entries_return",
-        "entries_found",
-        "entries_total",
-        "count_start",
-        "exits_placed",
-        "exits_returned_owner",
-        "exits_deceased",
-        "exits_escaped",
-        "exits_transferred",
-        "exits_total",
-        "count_end",
-    ]
-
     values = {}
-    for f in fields:
+    for f in ACTIVITY_COUNT_FIELDS:
         try:
             values[f] = int(request.form.get(f, 0))
         except:
@@ -2037,152 +3506,219 @@ def activity_report_details():
         exits_lists=data["exits_lists"]
     )
 
-@app.route("/documents/generate_pdf", methods=["POST"])
-def generate_pdf():
-    import io
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import mm
-    from datetime import datetime
-    from flask import send_file
-
-    # Récupère la liste des produits
-    products = [
-        ("1000006", "Bidon 5L détergent bactéricide flash DP pin"),
-        ("1000005", "Bidon 5L détergent bactéricide flash DP citron"),
-        ("1000108", "Pulvérisateur 750ml dégraissant virucide IDOS"),
-        ("002023104", "Bidon 1L détergent vaisselle"),
-        ("002020105", "Bidon 5L lessive liquide enzymes"),
-        ("123919", "Bidon 5L eau de javel 9.6°"),
-        ("002026002", "Pousse mousse savon mains 500ml"),
-        ("002061495", "Pulvérisateur 750ml nettoyant vitres"),
-        ("022207001", "Bidon 5L vinaigre ecocert"),
-        ("1000126", "Flacon 750ml WC gel gely bact"),
-        ("124097", "Carton 500 SAD 50L blancs"),
-        ("124858", "Carton 100 SAD 160L 55mm"),
-        ("124056", "Carton 500 SAD 30L corbeilles"),
-        ("132266", "Gant MAPA S-M-L-XL"),
-        ("1052", "Boîte 100 gants jetables latex S-M-L-XL"),
-        ("1082", "Boîte 100 gants jetables nitrile bleu S-M-L-XL"),
-        ("T376", "Paquet 10 éponges double face vert"),
-        ("00HE44", "Paquet 10 éponges n°4"),
-        ("2501003101", "Paquet 10 éponges magiques"),
-        ("T184", "Sachet 5 lavettes microfibre"),
-        ("T117", "Paquet 10 éponges inox"),
-        ("0702070", "Seau essoreur pour frange espagnol"),
-        ("1261", "Frange espagnol microfibre bleue"),
-        ("406900", "Colis 72 rouleaux papier toilette"),
-        ("416895", "Colis 6 bobines dévidage central"),
-        ("0212700001", "Aspirateur poussière"),
-        ("022000730", "Lot 20 sacs aspirateur"),
-    ]
-
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+# Lignes du rapport annuel : (libellé, compteur) ; None = séparateur
+ANNUAL_ENTRY_ROWS = [
+    ("Animaux en début de mois", "count_start"),
+    ("Abandons", "entries_abandon"),
+    ("Retours après placement", "entries_return"),
+    ("Trouvés", "entries_found"),
+    ("Total des entrées", "entries_total"),
+    ("Animaux en fin de mois", "count_end"),
+]
+ANNUAL_EXIT_ROWS = [
+    ("Placés", "exits_placed"),
+    ("Rendus à leur propriétaire", "exits_returned_owner"),
+    ("Décédés", "exits_deceased"),
+    ("Échappés", "exits_escaped"),
+    ("Transférés vers un autre établissement", "exits_transferred"),
+    ("Total des sorties", "exits_total"),
+]
+MONTH_SHORT_NAMES = ["", "Janv.", "Févr.", "Mars", "Avr.", "Mai", "Juin",
+                     "Juil.", "Août", "Sept.", "Oct.", "Nov.", "Déc."]
+
+
+@app.route("/documents/activity_report/annual")
+@site_protected
+def activity_report_annual():
+    try:
+        year = int(request.args.get("year") or datetime.now(TZ_PARIS).year)
+    except ValueError:
+        year = None
+    if year not in activity_report_years():
+        flash("Année invalide.", "danger")
+        return redirect(url_for("documents"))
 
-    green = colors.Color(0/255, 128/255, 0/255)
+    return render_template(
+        "activity_report_annual.html",
+        report=compute_annual_activity(year),
+        entry_rows=ANNUAL_ENTRY_ROWS,
+        exit_rows=ANNUAL_EXIT_ROWS,
+        month_names=MONTH_SHORT_NAMES,
+    )
 
-    # TITRE
-    c.setFillColor(green)
-    c.setFont("Helvetica-Bold", 28)
-    c.drawCentredString(width/2, height - 60, "IDF Diffusion")
 
-    # SOUS TITRE
-    c.setFont("Helvetica-Bold", 20)
-    c.drawCentredString(width/2, height - 95, "BON DE PRÉ-COMMANDE")
+@app.route("/documents/activity_report/annual/<int:year>.pdf")
+@site_protected
+def activity_report_annual_pdf(year):
+    if year not in activity_report_years():
+        return "Année sans rapport", 404
+
+    report = compute_annual_activity(year)
+    styles = PDF_SAMPLE_STYLES
+
+    def section_table(rows):
+        header = [""] + [MONTH_SHORT_NAMES[m["month"]] for m in report["months"]] + ["Total"]
+        data = [header]
+        for label, key in rows:
+            line = [label]
+            for m in report["months"]:
+                line.append(str(m["counts"][key]) if m["counts"] else "—")
+            line.append(str(report["totals"][key]) if report["totals"] else "—")
+            data.append(line)
+
+        table = Table(data, colWidths=[190] + [42] * 12 + [50], repeatRows=1)
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1f3a93")),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("FONTNAME", (-1, 1), (-1, -1), "Helvetica-Bold"),
+            ("FONTSIZE", (0, 0), (-1, -1), 9),
+            ("ALIGN", (1, 0), (-1, -1), "RIGHT"),
+            ("GRID", (0, 0), (-1, -1), 0.4, colors.black),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#eef1f8")]),
+        ]))
+        return table
 
-    # DATE
-    c.setFont("Helvetica", 12)
-    c.setFillColor(colors.black)
-    c.drawString(40, height - 140, f"Date : {datetime.now().strftime('%d/%m/%Y')}")
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer, pagesize=landscape(A4),
+        leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=30,
+        title=f"Rapport d'activité annuel {year}",
+    )
+    story = [
+        Paragraph(f"Rapport d'activité annuel {year} — Entrées et effectifs", styles["Title"]),
+        Spacer(1, 12),
+        section_table(ANNUAL_ENTRY_ROWS),
+        PageBreak(),
+        Paragraph(f"Rapport d'activité annuel {year} — Sorties", styles["Title"]),
+        Spacer(1, 12),
+        section_table(ANNUAL_EXIT_ROWS),
+    ]
+    doc.build(story)
+    buffer.seek(0)
 
-    # ADRESSE
-    c.setFont("Helvetica-Oblique", 12)
-    c.drawCentredString(width/2, height - 165,
-        "Refuge de Louveciennes – 24 route de Versailles – 78430 LOUVECIENNES"
+    return send_file(
+        buffer,
+        as_attachment=True,
+        download_name=f"Rapport d'activité annuel {year}.pdf",
+        mimetype="application/pdf",
     )
 
-    # TABLEAU
-    start_x = 30
-    start_y = height - 220
 
-    col_ref = 80
-    col_label = 300
-    col_qte = 50
-    line_h = 20
+# Mise en page du bon de pré-commande
+PURCHASE_ORDER_X = 30
+PURCHASE_ORDER_TOP = A4[1] - 200        # haut de la ligne d'en-tête
+PURCHASE_ORDER_COLS = (80, 300, 50)     # référence, désignation, quantité
+PURCHASE_ORDER_LINE_H = 20
+# Polices déclarées dans cet ordre sur chaque canvas : les noms internes
+# (/F1, /F2…) du gabarit précalculé restent ainsi valables
+PURCHASE_ORDER_FONTS = ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique")
 
-    table_width = col_ref + col_label + col_qte
+_products_cache = {"version": None, "products": ()}
 
-    # En-tête
-    c.setFont("Helvetica-Bold", 11)
-    c.rect(start_x, start_y, table_width, line_h)
 
-    # traits verticaux en-tête
-    c.line(start_x + col_ref, start_y, start_x + col_ref, start_y + line_h)
-    c.line(start_x + col_ref + col_label, start_y, start_x + col_ref + col_label, start_y + line_h)
+def purchase_order_products():
+    """Catalogue [(référence, désignation)], relu seulement quand la table product change."""
+    version = data_versions(["product"]).get("product", 0)
+    if _products_cache["version"] != version:
+        rows = (
+            db.session.query(Product.reference, Product.label)
+            .order_by(Product.position, Product.id)
+            .all()
+        )
+        _products_cache.update(version=version, products=tuple(tuple(r) for r in rows))
+    return _products_cache["products"]
 
-    c.drawString(start_x + 5, start_y + 6, "Référence")
-    c.drawString(start_x + col_ref + 5, start_y + 6, "Désignation")
-    c.drawString(start_x + col_ref + col_label + 5, start_y + 6, "Qté")
 
-        # lignes produits
-    y = start_y - line_h
-    c.setFont("Helvetica", 10)
+def purchase_order_canvas(out):
+    c = canvas.Canvas(out, pagesize=A4)
+    for font_name in PURCHASE_ORDER_FONTS:
+        c.setFont(font_name, 10)
+    return c
 
-    for ref, label in products:
-        qty = request.form.get(ref, "").strip()
 
-        # rectangle ligne
-        c.rect(start_x, y, table_width, line_h)
+@lru_cache(maxsize=4)
+def purchase_order_template(products: tuple) -> str:
+    """
+    Partie fixe du bon (titres, adresse, grille, références, désignations)
+    sous forme d'opérateurs PDF, calculée une fois par catalogue puis
+    rejouée telle quelle (addLiteral) dans chaque bon.
+    """
+    c = purchase_order_canvas(io.BytesIO())
+    width, height = A4
+    green = colors.Color(0/255, 128/255, 0/255)
 
-        # traits verticaux
-        c.line(start_x + col_ref, y, start_x + col_ref, y + line_h)
-        c.line(start_x + col_ref + col_label, y, start_x + col_ref + col_label, y + line_h)
+    def centred(t, font_name, font_size, y, text):
+        t.setFont(font_name, font_size)
+        t.setTextOrigin(width/2 - c.stringWidth(text, font_name, font_size) / 2, y)
+        t.textOut(text)
 
-        # texte
-        c.drawString(start_x + 5, y + 5, ref)
-        c.drawString(start_x + col_ref + 5, y + 5, label)
-        c.drawString(start_x + col_ref + col_label + 5, y + 5, qty)
+    t = c.beginText()
 
-        y -= line_h
+    # TITRE + SOUS TITRE
+    t.setFillColor(green)
+    centred(t, "Helvetica-Bold", 28, height - 60, "IDF Diffusion")
+    centred(t, "Helvetica-Bold", 20, height - 95, "BON DE PRÉ-COMMANDE")
 
-    # aucune nouvelle page ici
-    c.save()
-    buffer.seek(0)
+    # ADRESSE
+    t.setFillColor(colors.black)
+    centred(t, "Helvetica-Oblique", 12, height - 165,
+            "Refuge de Louveciennes – 24 route de Versailles – 78430 LOUVECIENNES")
+
+    # En-tête du tableau
+    ref_x = PURCHASE_ORDER_X + 5
+    label_x = ref_x + PURCHASE_ORDER_COLS[0]
+    qty_x = label_x + PURCHASE_ORDER_COLS[1]
+    header_y = PURCHASE_ORDER_TOP - PURCHASE_ORDER_LINE_H
+    t.setFont("Helvetica-Bold", 11)
+    for x, text in ((ref_x, "Référence"), (label_x, "Désignation"), (qty_x, "Qté")):
+        t.setTextOrigin(x, header_y + 6)
+        t.textOut(text)
+
+    # lignes produits
+    t.setFont("Helvetica", 10)
+    y = header_y - PURCHASE_ORDER_LINE_H
+    for ref, label in products:
+        t.setTextOrigin(ref_x, y + 5)
+        t.textOut(ref)
+        t.setTextOrigin(label_x, y + 5)
+        t.textOut(label)
+        y -= PURCHASE_ORDER_LINE_H
 
+    grid = pdf_table_grid(PURCHASE_ORDER_X, PURCHASE_ORDER_TOP, PURCHASE_ORDER_COLS,
+                          PURCHASE_ORDER_LINE_H, len(products) + 1)
+    return f"{grid.getCode()} S\n{t.getCode()}"
 
-     # ---------- Sauvegarde sur le disque + enregistrement en base ----------
-    orders_folder = os.path.join(app.config["UPLOAD_FOLDER"], "orders")
-    os.makedirs(orders_folder, exist_ok=True)
 
-    now_ts = datetime.now(TZ_PARIS)
-    filename = f"bon_de_commande_{now_ts.strftime('%Y%m%d_%H%M%S')}.pdf"
-    display_name = f"Bon de commande IDF {now_ts.strftime('%d.%m.%y')}.pdf"
-    file_path = os.path.join(orders_folder, filename)
+def render_purchase_order_pdf(out, products, quantities: dict, when: datetime):
+    """Bon de pré-commande écrit dans `out` : gabarit fixe + date et quantités par-dessus."""
+    products = tuple(products)
+    c = purchase_order_canvas(out)
+    c.addLiteral(purchase_order_template(products))
 
-    # On écrit le PDF sur le disque
-    with open(file_path, "wb") as f:
-        f.write(buffer.getvalue())
+    # DATE
+    c.setFont("Helvetica", 12)
+    c.drawString(40, A4[1] - 140, f"Date : {when.strftime('%d/%m/%Y')}")
 
-    # Enregistrement en base pour l'historique
-    po = PurchaseOrder(
-        order_date=now_ts.date(),
-        pdf_filename=filename,
-        created_at=now_ts
-    )
-    db.session.add(po)
-    db.session.commit()
+    # QUANTITÉS
+    c.setFont("Helvetica", 10)
+    qty_x = PURCHASE_ORDER_X + sum(PURCHASE_ORDER_COLS[:2]) + 5
+    y = PURCHASE_ORDER_TOP - 2 * PURCHASE_ORDER_LINE_H
+    for ref, _ in products:
+        qty = quantities.get(ref, "")
+        if qty:
+            c.drawString(qty_x, y + 5, qty)
+        y -= PURCHASE_ORDER_LINE_H
 
-    # On renvoie aussi le PDF au navigateur avec le bon nom
-    buffer.seek(0)
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=display_name,
-        mimetype="application/pdf"
-    )
+    # aucune nouvelle page ici
+    c.save()
+
+
+@app.route("/documents/generate_pdf", methods=["POST"])
+def generate_pdf():
+    quantities = {ref: request.form.get(ref, "").strip() for ref, _ in purchase_order_products()}
+    job_id = pdf_jobs.submit("purchase_order", build_purchase_order, quantities)
+    return pdf_job_response(job_id)
 
 @app.route("/documents/orders/<int:order_id>")
 @site_protected
@@ -2196,7 +3732,7 @@ def order_download(order_id):
         flash("Le fichier PDF de ce bon de commande est introuvable sur le serveur.", "danger")
         return redirect(url_for("documents"))
 
-    return send_file(file_path, as_attachment=False)
+    return send_pdf(file_path)
 
 
 @app.post("/documents/orders/<int:order_id>/delete")
@@ -2227,29 +3763,70 @@ def order_delete(order_id):
 # APPOINTMENTS (PAGE + CREATION)
 # ============================================================
 
+# -------------------- /appointments : historique par curseur --------------------
+PAST_APPOINTMENTS_PAGE = 50
+
+
+def encode_datetime_cursor(value: datetime, row_id: int) -> str:
+    raw = json.dumps([value.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_datetime_cursor(cursor: str):
+    value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(value), int(row_id)
+
+
+def past_appointments_page(kind, now, after=None):
+    """
+    Une page (PAST_APPOINTMENTS_PAGE lignes) de RDV passés, du plus récent au
+    plus ancien, par curseur (date, id) : coût constant quelle que soit la
+    taille de l'historique. Renvoie (lignes, curseur suivant ou None).
+    """
+    if kind == "chats":
+        when, query = Appointment.date, appointments_with_names()
+        model = Appointment
+    else:
+        # une série encore en cours reste dans « À venir »
+        when = GeneralAppointment.start
+        query = GeneralAppointment.query.filter(db.not_(is_running_series(now.date())))
+        model = GeneralAppointment
+
+    query = query.filter(when < now)
+    if after is not None:
+        query = query.filter(db.tuple_(when, model.id) < after)
+    rows = (
+        query.order_by(when.desc(), model.id.desc())
+        .limit(PAST_APPOINTMENTS_PAGE + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(rows) > PAST_APPOINTMENTS_PAGE:
+        rows = rows[:PAST_APPOINTMENTS_PAGE]
+        last = rows[-1]
+        next_cursor = encode_datetime_cursor(
+            last.date if kind == "chats" else last.start, last.id
+        )
+    return rows, next_cursor
+
+
 @app.route("/appointments")
 @site_protected
 def appointments_page():
-    # "now" en heure de Paris mais SANS timezone (comme stocké en base)
-    now_paris = datetime.now(TZ_PARIS)
-    now = now_paris.replace(tzinfo=None)
+    now = paris_now()
 
-    upcoming = Appointment.query.filter(
+    upcoming = appointments_with_names().filter(
         Appointment.date >= now
     ).order_by(Appointment.date).all()
 
-    past = Appointment.query.filter(
-        Appointment.date < now
-    ).order_by(Appointment.date.desc()).all()
-    
-    # 🔧 Force timezone Paris pour tous les RDV pour l'AFFICHAGE
-    for a in upcoming:
-        if a.date.tzinfo is None:
-            a.date = a.date.replace(tzinfo=TZ_PARIS)
+    upcoming_general = GeneralAppointment.query.filter(
+        db.or_(GeneralAppointment.start >= now, is_running_series(now.date()))
+    ).order_by(GeneralAppointment.start).all()
 
-    for a in past:
-        if a.date.tzinfo is None:
-            a.date = a.date.replace(tzinfo=TZ_PARIS)
+    # Passés : première page seulement, la suite via /appointments/past/<kind>
+    past, past_cursor = past_appointments_page("chats", now)
+    past_general, past_general_cursor = past_appointments_page("general", now)
 
     # 🔹 TOUS les chats présents (ou en FA), pas seulement "Besoin véto"
     cats = Cat.query.filter(
@@ -2263,28 +3840,46 @@ def appointments_page():
     employees = Employee.query.order_by(Employee.name).all()
     veterinarians = Veterinarian.query.order_by(Veterinarian.name).all()
 
-    general = GeneralAppointment.query.order_by(GeneralAppointment.start.desc()).all()
-    
-    # 🔧 Force timezone Paris pour les RDV généraux
-    for g in general:
-        if g.start and g.start.tzinfo is None:
-            g.start = g.start.replace(tzinfo=TZ_PARIS)
-        if g.end and g.end.tzinfo is None:
-            g.end = g.end.replace(tzinfo=TZ_PARIS)
-
     return render_template(
         "appointments.html",
         upcoming=upcoming,
         past=past,
-        general=general,
+        past_cursor=past_cursor,
+        upcoming_general=upcoming_general,
+        past_general=past_general,
+        past_general_cursor=past_general_cursor,
+        month_names=MONTH_NAMES_UPPER,
         cats=cats,
         employees=employees,
         veterinarians=veterinarians,
-        datetime=datetime,
-        TZ_PARIS=TZ_PARIS,
     )
 
 
+@app.route("/appointments/past/<kind>")
+@site_protected
+def appointments_past(kind):
+    """Page suivante des RDV passés (fragment <li>), curseur suivant en X-Next-Cursor."""
+    if kind not in ("chats", "general"):
+        return "Liste inconnue", 404
+    try:
+        after = decode_datetime_cursor(request.args.get("after", ""))
+    except (ValueError, TypeError):
+        return jsonify({"error": "curseur invalide"}), 400
+
+    rows, next_cursor = past_appointments_page(kind, paris_now(), after)
+    resp = make_response(render_template(
+        f"appointments/_past_{kind}.html",
+        rows=rows,
+        # le curseur porte la date de la dernière ligne affichée : pas de
+        # titre de mois répété en tête de page
+        previous=after[0],
+        month_names=MONTH_NAMES_UPPER,
+    ))
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
+
+
 
 
 @app.route("/appointments/create", methods=["POST"])
@@ -2303,7 +3898,7 @@ def appointments_create():
         dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
 
     appt = Appointment(
-        date=dt,  # 🔥 on stocke NAÏF, sans tzinfo
+        date=dt,  # heure de Paris saisie (naïve)
         location=location,
         created_by=request.form.get("created_by") or None
     )
@@ -2312,16 +3907,15 @@ def appointments_create():
     db.session.flush()  # pour récupérer appt.id
 
 
-     # Chats sélectionnés
-    for cid in request.form.getlist("cats[]"):
-        cid = cid.strip()
-        if cid.isdigit() and Cat.query.get(int(cid)):
-            db.session.add(AppointmentCat(appointment_id=appt.id, cat_id=int(cid)))
-
-    # Employés sélectionnés
-    for eid in request.form.getlist("employees[]"):
-        if eid.isdigit() and Employee.query.get(int(eid)):
-            db.session.add(AppointmentEmployee(appointment_id=appt.id, employee_id=int(eid)))
+    # Chats / employés sélectionnés (ids vérifiés en une requête par table)
+    sync_appointment_links(
+        appt.id, AppointmentCat, AppointmentCat.cat_id,
+        existing_ids(Cat, request.form.getlist("cats[]")),
+    )
+    sync_appointment_links(
+        appt.id, AppointmentEmployee, AppointmentEmployee.employee_id,
+        existing_ids(Employee, request.form.getlist("employees[]")),
+    )
 
     db.session.commit()
     return redirect(url_for("appointments_page"))
@@ -2337,11 +3931,6 @@ def vet_reports_page():
         .all()
     )
 
-    # Force timezone Paris pour l'affichage
-    for a in appointments:
-        if a.date and a.date.tzinfo is None:
-            a.date = a.date.replace(tzinfo=TZ_PARIS)
-
     # 🔹 HISTORIQUE PAR RDV / CHAT
     vet_history = {}
     appt_ids = [a.id for a in appointments]
@@ -2409,7 +3998,6 @@ def vet_reports_page():
         task_types=task_types,
         employees=employees,
         veterinarians=veterinarians,
-        TZ_PARIS=TZ_PARIS,
         vet_history=vet_history,  # 🔹 nouveau
     )
 
@@ -2555,17 +4143,18 @@ def appointments_create_general():
     if not start_str:
         return redirect(url_for("appointments_page"))
 
-    # On parse en NAÏF (heure locale), sans timezone
+    # Saisie naïve = heure de Paris (ParisDateTime y attache le fuseau)
     start = parse_date_optional_time(start_str)
     end = parse_date_optional_time(end_str) if end_str else None
 
     ga = GeneralAppointment(
         title=title,
-        start=start,   # 🔥 NAÏF
-        end=end,       # 🔥 NAÏF
+        start=start,
+        end=end,
         note=note,
         color="orange"
     )
+    apply_recurrence_form(ga, request.form)
 
     db.session.add(ga)
     db.session.commit()
@@ -2573,9 +4162,12 @@ def appointments_create_general():
     return redirect(url_for("appointments_page"))
 
 # -------------------- FullCalendar events --------------------
+# Heure murale de Paris, sans offset : FullCalendar l'affiche telle quelle
+CALENDAR_WALL_TIME = "%Y-%m-%dT%H:%M:%S"
 
 @app.route("/appointments_events")
 @site_protected
+@versioned_etag("appointment", "appointment_cat", "appointment_employee", "cat", "employee")
 def appointments_events():
     """Ancien endpoint JSON simple pour le calendrier (compatibilité)."""
     events = []
@@ -2592,75 +4184,574 @@ def appointments_events():
 
         events.append({
             "title": title,
-            "start": a.date.isoformat(),
+            "start": a.date.strftime(CALENDAR_WALL_TIME),
+        })
+
+    return jsonify(events)
+
+
+def parse_calendar_bound(value):
+    """
+    Borne ?start / ?end de FullCalendar ("2026-09-28", "2026-09-28T00:00:00+02:00",
+    "…Z") -> datetime à l'heure de Paris (sans offset : déjà heure de Paris).
+    """
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.replace(" ", "+"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=TZ_PARIS)
+    return dt.astimezone(TZ_PARIS)
+
+
+# -------------------- RDV généraux récurrents --------------------
+# valeur du formulaire -> (fréquence, libellé, libellé avec intervalle)
+RECURRENCE_RULES = {
+    "daily": (DAILY, "Tous les jours", "Tous les {n} jours"),
+    "weekly": (WEEKLY, "Toutes les semaines", "Toutes les {n} semaines"),
+    "monthly": (MONTHLY, "Tous les mois", "Tous les {n} mois"),
+}
+RECURRENCE_HORIZON = timedelta(days=365)   # sans ?end : un an d'occurrences
+RECURRENCE_CACHE_MAX = 2048                # fenêtres gardées en mémoire
+
+
+def is_running_series(day):
+    """Filtre SQL : séries qui ont encore des occurrences le `day` ou après."""
+    return db.and_(
+        GeneralAppointment.recurrence.isnot(None),
+        db.or_(
+            GeneralAppointment.recurrence_until.is_(None),
+            GeneralAppointment.recurrence_until >= day,
+        ),
+    )
+
+
+def recurrence_until_datetime(g):
+    """Fin de la série (dernier jour inclus, 23:59:59 heure de Paris) ou None."""
+    if not g.recurrence_until:
+        return None
+    return datetime.combine(g.recurrence_until, datetime.max.time(), tzinfo=TZ_PARIS)
+
+
+def recurrence_exception_dates(g) -> set:
+    return {date.fromisoformat(d) for d in (g.recurrence_exceptions or "").split(",") if d}
+
+
+def parse_date_list(value) -> list:
+    """"20/10/2026, 2026-11-03" -> dates triées (valeurs illisibles ignorées)."""
+    days = set()
+    for raw in value.replace(";", ",").split(","):
+        raw = raw.strip()
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                days.add(datetime.strptime(raw, fmt).date())
+                break
+            except ValueError:
+                pass
+    return sorted(days)
+
+
+def apply_recurrence_form(g, form):
+    """Champs « Répétition » d'un formulaire -> série (RDV simple si « Aucune »)."""
+    recurrence = form.get("recurrence") or None
+    if recurrence not in RECURRENCE_RULES:
+        g.recurrence, g.recurrence_interval = None, 1
+        g.recurrence_until = g.recurrence_exceptions = None
+        return
+
+    g.recurrence = recurrence
+    try:
+        g.recurrence_interval = max(1, int(form.get("recurrence_interval") or 1))
+    except ValueError:
+        g.recurrence_interval = 1
+    until = parse_date_list(form.get("recurrence_until") or "")
+    g.recurrence_until = until[0] if until else None
+    exceptions = parse_date_list(form.get("recurrence_exceptions") or "")
+    g.recurrence_exceptions = ",".join(d.isoformat() for d in exceptions) or None
+
+
+@app.template_filter("recurrence")
+def recurrence_text(g):
+    """« Toutes les 2 semaines jusqu'au 31/12/2026 » ("" pour un RDV simple)."""
+    if not g.recurrence:
+        return ""
+    _, label, label_n = RECURRENCE_RULES[g.recurrence]
+    text = label_n.format(n=g.recurrence_interval) if g.recurrence_interval > 1 else label
+    if g.recurrence_until:
+        text += f" jusqu'au {g.recurrence_until.strftime('%d/%m/%Y')}"
+    return text
+
+
+def expand_recurrence(g, window_start, window_end) -> tuple:
+    """
+    (début, fin) des occurrences de la série `g` qui recoupent
+    [window_start, window_end[, dates annulées exclues. L'heure murale est
+    gardée au changement d'heure ; un 31 saute les mois plus courts
+    (comme iCalendar).
+    """
+    duration = (g.end - g.start) if g.end else None
+    # une occurrence commencée avant la fenêtre peut encore la recouper
+    lower = window_start - (duration or timedelta(0))
+
+    # rrule part toujours de dtstart : pour une série ancienne, on l'avance
+    # d'un nombre entier de périodes jusque juste avant la fenêtre (jours /
+    # semaines fixes ; l'heure murale reste la même)
+    dtstart = g.start
+    period_days = {"daily": 1, "weekly": 7}.get(g.recurrence)
+    if period_days:
+        period_days *= g.recurrence_interval
+        periods = ((lower.astimezone(TZ_PARIS).date() - dtstart.date()).days - 1) // period_days
+        if periods > 0:
+            dtstart += timedelta(days=periods * period_days)
+
+    rule = rrule(
+        RECURRENCE_RULES[g.recurrence][0],
+        dtstart=dtstart,
+        interval=g.recurrence_interval,
+        until=recurrence_until_datetime(g),
+    )
+    skipped = recurrence_exception_dates(g)
+
+    occurrences = []
+    for start in rule.between(lower, window_end, inc=True):
+        end = start + duration if duration else None
+        if start.date() in skipped or start >= window_end:
+            continue
+        if start >= window_start or (end and end > window_start):
+            occurrences.append((start, end))
+    return tuple(occurrences)
+
+
+class RecurrenceCache:
+    """
+    Occurrences par (série, fenêtre) gardées en mémoire (par process) :
+    revenir sur un mois déjà affiché ne recalcule rien. Une entrée ne vaut
+    que pour la version de la série (updated_at), et modifier / supprimer
+    la série oublie ses fenêtres (forget).
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def occurrences(self, g, window_start, window_end):
+        key = (g.id, window_start, window_end)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == g.updated_at:
+            return entry[1]
+
+        occurrences = expand_recurrence(g, window_start, window_end)
+        with self.lock:
+            if len(self.entries) >= RECURRENCE_CACHE_MAX:
+                self.entries.clear()
+            self.entries[key] = (g.updated_at, occurrences)
+        return occurrences
+
+    def forget(self, series_id):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == series_id]:
+                del self.entries[key]
+
+
+recurrence_cache = RecurrenceCache()
+
+
+def appointment_event(a):
+    """Évènement FullCalendar d'un RDV chats / vétérinaire (bleu)."""
+    cats_str = ", ".join(ca.cat.name for ca in a.cats)
+    emps_str = ", ".join(emp.employee.name for emp in a.employees)
+
+    tooltip_lines = [
+        a.date.strftime("%d/%m/%Y %H:%M"),
+        f"Lieu : {a.location or '—'}",
+    ]
+    if cats_str:
+        tooltip_lines.append(f"Chats : {cats_str}")
+    if emps_str:
+        tooltip_lines.append(f"Employés : {emps_str}")
+
+    tooltip = "\n".join(tooltip_lines)
+
+    return {
+        "id": a.id,
+        "title": a.location or "Rendez-vous",
+        "start": a.date.strftime(CALENDAR_WALL_TIME),
+        "backgroundColor": "#3A7AFE",     # 💙 RDV chats = bleu
+        "borderColor": "#3A7AFE",
+        "extendedProps": {
+            "tooltip": tooltip,
+            "cats": cats_str,
+            "employees": emps_str,
+            "location": a.location or "",
+        },
+        "url": url_for("appointments_page"),
+    }
+
+
+def general_event(g, start=None, end=None):
+    """Évènement FullCalendar d'un RDV général (orange), ou d'une occurrence de série."""
+    if start is None:
+        start, end = g.start, g.end
+
+    tooltip = start.strftime("%d/%m/%Y %H:%M")
+    if end:
+        tooltip += " → " + end.strftime("%d/%m/%Y %H:%M")
+    if g.recurrence:
+        tooltip += f"\n🔁 {recurrence_text(g)}"
+    if g.note:
+        tooltip += f"\nNote : {g.note}"
+
+    return {
+        "id": f"g-{g.id}-{start:%Y%m%d}" if g.recurrence else f"g-{g.id}",
+        "groupId": f"g-{g.id}",     # toutes les occurrences d'une série
+        "title": g.title,
+        "start": start.strftime(CALENDAR_WALL_TIME),
+        "end": end.strftime(CALENDAR_WALL_TIME) if end else None,
+
+        "backgroundColor": "#FFA500",
+        "borderColor": "#FFA500",
+
+        "extendedProps": {
+            "tooltip": tooltip,
+            "location": g.title,
+            "note": g.note or None,
+        }
+    }
+
+
+def general_events(g, window_start, window_end):
+    """Le RDV général lui-même, ou les occurrences de la série dans la fenêtre."""
+    if not g.recurrence:
+        return [general_event(g)]
+    return [
+        general_event(g, start, end)
+        for start, end in recurrence_cache.occurrences(g, window_start or g.start, window_end)
+    ]
+
+
+def appointments_with_names():
+    """RDV chats avec noms des chats / employés chargés en deux requêtes (selectin)."""
+    return Appointment.query.options(
+        db.selectinload(Appointment.cats)
+        .joinedload(AppointmentCat.cat)
+        .load_only(Cat.id, Cat.name),
+        db.selectinload(Appointment.employees).joinedload(AppointmentEmployee.employee),
+    )
+
+
+# Marge de relecture d'une synchro à l'autre : une modification datée juste
+# avant `server_time` mais commitée juste après n'est pas perdue
+CALENDAR_SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def calendar_changes(since):
+    """
+    (RDV chats, RDV généraux) créés, modifiés ou supprimés depuis `since`,
+    supprimés compris (deleted_at renseigné).
+    """
+    since = since - CALENDAR_SYNC_OVERLAP
+    appointments = (
+        appointments_with_names()
+        .filter(Appointment.updated_at > since)
+        .execution_options(include_deleted=True)
+        .all()
+    )
+    general = (
+        GeneralAppointment.query
+        .filter(GeneralAppointment.updated_at > since)
+        .execution_options(include_deleted=True)
+        .all()
+    )
+    return appointments, general
+
+
+@app.route("/api/appointments")
+@site_protected
+@versioned_etag(
+    "appointment", "appointment_cat", "appointment_employee", "cat", "employee",
+    "general_appointment",
+    # sans ?end, les occurrences des séries vont jusqu'à aujourd'hui + un an
+    daily=True,
+)
+def api_appointments():
+    """
+    Endpoint JSON détaillé pour le calendrier (FullCalendar du dashboard).
+    FullCalendar envoie la fenêtre affichée (?start=…&end=…) : seuls les RDV
+    qui la recoupent sont chargés (sans paramètres : tous les RDV).
+    ?updated_since=… : seulement les RDV modifiés / supprimés depuis,
+    {"events": [...], "deleted": [ids], "server_time": prochain updated_since,
+    "refetch": true si une série a changé (occurrences à recharger)}.
+    Les séries de RDV généraux sont développées pour la fenêtre demandée.
+    """
+    try:
+        window_start = parse_calendar_bound(request.args.get("start"))
+        window_end = parse_calendar_bound(request.args.get("end"))
+        updated_since = parse_calendar_bound(request.args.get("updated_since"))
+    except ValueError:
+        return jsonify({"error": "start / end / updated_since attendus au format ISO 8601"}), 400
+
+    if updated_since is not None:
+        server_time = paris_now()
+        appointments, general = calendar_changes(updated_since)
+        return jsonify({
+            "events": [appointment_event(a) for a in appointments if a.deleted_at is None]
+                      + [general_event(g) for g in general
+                         if g.deleted_at is None and not g.recurrence],
+            # une série modifiée est retirée (groupId) puis rechargée par fenêtre
+            "deleted": [str(a.id) for a in appointments if a.deleted_at is not None]
+                       + [f"g-{g.id}" for g in general
+                          if g.deleted_at is not None or g.recurrence],
+            "refetch": any(g.recurrence and g.deleted_at is None for g in general),
+            "server_time": server_time.isoformat(),
         })
 
+    appointments = appointments_with_names()
+    general = GeneralAppointment.query
+    if window_start is not None:
+        appointments = appointments.filter(Appointment.date >= window_start)
+        # RDV généraux retenus : début dans la fenêtre ou commencé avant et
+        # pas encore fini (deux branches indexées), plus les séries pas encore
+        # terminées, dont les occurrences sont calculées plus bas
+        general = general.filter(db.or_(
+            GeneralAppointment.start >= window_start,
+            GeneralAppointment.end > window_start,
+            is_running_series(window_start.date()),
+        ))
+    if window_end is not None:
+        appointments = appointments.filter(Appointment.date < window_end)
+        general = general.filter(GeneralAppointment.start < window_end)
+    else:
+        window_end = (
+            paris_now().replace(hour=0, minute=0, second=0, microsecond=0) + RECURRENCE_HORIZON
+        )
+
+    events = [appointment_event(a) for a in appointments.all()]   # --- RDV chats (bleu)
+    for g in general.all():                                        # --- RDV généraux (orange)
+        events += general_events(g, window_start, window_end)
     return jsonify(events)
 
 
-@app.route("/api/appointments")
-@site_protected
-def api_appointments():
-    """Endpoint JSON détaillé pour le calendrier (FullCalendar du dashboard)."""
-    events = []
+# -------------------- Flux iCalendar (.ics) --------------------
+ICS_PAST_DAYS = 60          # historique publié dans le flux
+ICS_TOKEN = os.environ.get("CALENDAR_ICS_TOKEN")   # ?token=… des téléphones
+
+# Définition du TZID=Europe/Paris des DTSTART / DTEND (RFC 5545 §3.2.19) :
+# heure d'été du dernier dimanche de mars au dernier dimanche d'octobre
+ICS_VTIMEZONE_PARIS = "\r\n".join([
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Paris",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]) + "\r\n"
+
+
+def ics_escape(value):
+    return (
+        (value or "").replace("\\", "\\\\").replace(";", "\\;")
+        .replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def ics_fold(line):
+    """Lignes de 75 octets max, suites préfixées d'un espace (RFC 5545)."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, start = [], 0
+    while start < len(raw):
+        end = min(start + (75 if not parts else 74), len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:   # pas au milieu d'un caractère
+            end -= 1
+        parts.append(raw[start:end].decode("utf-8"))
+        start = end
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_utc(value):
+    return value.astimezone(ZoneInfo("UTC")).strftime("%Y%m%dT%H%M%SZ")
+
+
+def ics_recurrence(g):
+    """RRULE / EXDATE d'une série : le téléphone développe lui-même les occurrences."""
+    rule = f"RRULE:FREQ={g.recurrence.upper()};INTERVAL={g.recurrence_interval}"
+    if g.recurrence_until:
+        rule += f";UNTIL={ics_utc(recurrence_until_datetime(g))}"
+    lines = [rule]
+    for day in sorted(recurrence_exception_dates(g)):
+        exdate = datetime.combine(day, g.start.time())
+        lines.append(f"EXDATE;TZID=Europe/Paris:{exdate.strftime('%Y%m%dT%H%M%S')}")
+    return lines
+
+
+def ics_vevent(uid, start, end, summary, description, stamp, recurrence=()):
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{ics_utc(stamp)}",
+        f"DTSTART;TZID=Europe/Paris:{start.strftime('%Y%m%dT%H%M%S')}",
+        f"DTEND;TZID=Europe/Paris:{end.strftime('%Y%m%dT%H%M%S')}",
+        *recurrence,
+        f"SUMMARY:{ics_escape(summary)}",
+    ]
+    if description:
+        lines.append(f"DESCRIPTION:{ics_escape(description)}")
+    lines.append("END:VEVENT")
+    return "".join(ics_fold(line) for line in lines)
+
 
-    # --- RDV chats / vétérinaires --- (bleu)
-    for a in Appointment.query.all():
-        cats_str = ", ".join(ca.cat.name for ca in a.cats)
-        emps_str = ", ".join(emp.employee.name for emp in a.employees)
+class IcsFeedCache:
+    """
+    VEVENT déjà sérialisés, par UID (par process), limités à la fenêtre
+    publiée (ICS_PAST_DAYS). Chaque requête ne relit que les RDV modifiés /
+    supprimés depuis la précédente (calendar_changes) et, si un chat ou un
+    employé a changé de nom, les RDV de la fenêtre qui le citent.
+    """
 
-        tooltip_lines = [
-            a.date.astimezone(TZ_PARIS).strftime("%d/%m/%Y %H:%M"),
-            f"Lieu : {a.location or '—'}",
-        ]
-        if cats_str:
-            tooltip_lines.append(f"Chats : {cats_str}")
-        if emps_str:
-            tooltip_lines.append(f"Employés : {emps_str}")
+    def __init__(self):
+        self.events = {}        # uid -> (début, dernière occurrence, texte VEVENT)
+        self.synced_at = None
+        self.names_version = None
+        self.cat_names = {}     # id -> nom, tels que sérialisés dans les VEVENT
+        self.employee_names = {}
+        self.lock = threading.Lock()
+
+    def serialize(self, a=None, g=None):
+        if a is not None:
+            event = appointment_event(a)
+            uid = f"appointment-{a.id}@leschatsdelou"
+            start = a.date
+            end = a.date + timedelta(hours=1)
+            summary = event["title"]
+            description = event["extendedProps"]["tooltip"]
+            stamp = a.updated_at or a.date
+            last, recurrence = start, ()
+        else:
+            uid = f"general-{g.id}@leschatsdelou"
+            start = g.start
+            end = g.end or g.start + timedelta(hours=1)
+            summary = g.title
+            description = g.note
+            stamp = g.updated_at or g.start
+            last, recurrence = start, ()
+            if g.recurrence:
+                last = recurrence_until_datetime(g) or datetime.max.replace(tzinfo=TZ_PARIS)
+                recurrence = ics_recurrence(g)
+        vevent = ics_vevent(uid, start, end, summary, description, stamp, recurrence)
+        return uid, (start, last, vevent)
+
+    def renamed(self):
+        """
+        (ids de chats, ids d'employés) dont le nom a changé depuis la dernière
+        lecture, ou None si l'un a disparu (ses liens aussi : relecture complète).
+        """
+        cat_names = dict(db.session.execute(select(Cat.id, Cat.name)).all())
+        employee_names = dict(db.session.execute(select(Employee.id, Employee.name)).all())
+        if self.cat_names.keys() - cat_names.keys() or self.employee_names.keys() - employee_names.keys():
+            changed = None
+        else:
+            changed = (
+                [i for i, name in self.cat_names.items() if cat_names[i] != name],
+                [i for i, name in self.employee_names.items() if employee_names[i] != name],
+            )
+        self.cat_names, self.employee_names = cat_names, employee_names
+        return changed
+
+    def refresh(self, versions):
+        with self.lock:
+            now = paris_now()
+            cutoff = now - timedelta(days=ICS_PAST_DAYS)
+            in_window = appointments_with_names().filter(Appointment.date >= cutoff)
+
+            # un chat / employé renommé ne date pas les RDV : on relit ceux de
+            # la fenêtre qui le citent (les RDV généraux ne citent personne)
+            names_version = (versions.get("cat", 0), versions.get("employee", 0))
+            renamed = ([], [])
+            if names_version != self.names_version:
+                self.names_version = names_version
+                renamed = self.renamed()
+
+            if self.synced_at is None or renamed is None:
+                self.events = {}
+                appointments = in_window.all()
+                general = GeneralAppointment.query.filter(db.or_(
+                    GeneralAppointment.start >= cutoff, is_running_series(cutoff.date())
+                )).all()
+            else:
+                appointments, general = calendar_changes(self.synced_at)
+                cat_ids, employee_ids = renamed
+                if cat_ids or employee_ids:
+                    appointments += in_window.filter(db.or_(
+                        Appointment.cats.any(AppointmentCat.cat_id.in_(cat_ids)),
+                        Appointment.employees.any(AppointmentEmployee.employee_id.in_(employee_ids)),
+                    )).all()
+
+            for a in appointments:
+                uid, entry = self.serialize(a=a)
+                if a.deleted_at is None:
+                    self.events[uid] = entry
+                else:
+                    self.events.pop(uid, None)
+            for g in general:
+                uid, entry = self.serialize(g=g)
+                if g.deleted_at is None:
+                    self.events[uid] = entry
+                else:
+                    self.events.pop(uid, None)
+            self.synced_at = now
 
-        tooltip = "\n".join(tooltip_lines)
+            self.events = {uid: entry for uid, entry in self.events.items() if entry[1] >= cutoff}
+            return sorted(self.events.values(), key=lambda entry: entry[0])
 
-        events.append({
-            "id": a.id,
-            "title": a.location or "Rendez-vous",
-            "start": a.date.isoformat(),
-            "backgroundColor": "#3A7AFE",     # 💙 RDV chats = bleu
-            "borderColor": "#3A7AFE",
-            "extendedProps": {
-                "tooltip": tooltip,
-                "cats": cats_str,
-                "employees": emps_str,
-                "location": a.location or "",
-            },
-            "url": url_for("appointments_page"),
-        })
 
-    # --- RDV généraux --- (orange)
-    for g in GeneralAppointment.query.all():
+ics_feed_cache = IcsFeedCache()
 
-        tooltip = g.start.astimezone(TZ_PARIS).strftime("%d/%m/%Y %H:%M")
-        if g.end:
-            tooltip += " → " + g.end.astimezone(TZ_PARIS).strftime("%d/%m/%Y %H:%M")
-        if g.note:
-            tooltip += f"\nNote : {g.note}"
 
-        events.append({
-            "id": f"g-{g.id}",
-            "title": g.title,
-            "start": g.start.isoformat(),
-            "end": g.end.isoformat() if g.end else None,
-
-            "backgroundColor": "#FFA500",
-            "borderColor": "#FFA500",
-
-            "extendedProps": {
-                "tooltip": tooltip,
-                "location": g.title,
-                "note": g.note or None,
-            }
-        })
+@app.route("/calendar.ics")
+def calendar_ics():
+    """
+    Flux iCalendar des RDV (abonnement depuis un téléphone), protégé par
+    ?token= (CALENDAR_ICS_TOKEN) ou la session. Réponse en flux, 304 si
+    aucun RDV n'a changé.
+    """
+    token = request.args.get("token") or ""
+    if session.get("authenticated") is not True and not (
+        ICS_TOKEN and hmac.compare_digest(token.encode(), ICS_TOKEN.encode())
+    ):
+        return "Accès refusé", 403
+
+    def build(versions):
+        entries = ics_feed_cache.refresh(versions)
+
+        def generate():
+            yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Les Chats de Lou//Calendrier//FR\r\n"
+            yield "X-WR-CALNAME:Rendez-vous refuge\r\nX-WR-TIMEZONE:Europe/Paris\r\n"
+            yield ICS_VTIMEZONE_PARIS
+            for _, _, vevent in entries:
+                yield vevent
+            yield "END:VCALENDAR\r\n"
+
+        return app.response_class(
+            stream_with_context(generate()), mimetype="text/calendar; charset=utf-8"
+        )
 
-    return jsonify(events)
+    return versioned_response(
+        ("appointment", "appointment_cat", "appointment_employee", "cat", "employee",
+         "general_appointment"),
+        build,
+        daily=True,
+    )
 
 
 
@@ -2700,30 +4791,18 @@ def cat_detail(cat_id):
         .all()
     )
 
-    # Force la timezone Paris pour l'affichage
-    for a in vet_appointments:
-        if a.date and a.date.tzinfo is None:
-            a.date = a.date.replace(tzinfo=TZ_PARIS)
-
     # 🔹 RDV vétérinaires à venir pour ce chat
-    now_paris = datetime.now(TZ_PARIS)
-    now_naive = now_paris.replace(tzinfo=None)
-
     upcoming_vet_appointments = (
         Appointment.query
         .join(AppointmentCat)
         .filter(
             AppointmentCat.cat_id == cat_id,
-            Appointment.date >= now_naive,
+            Appointment.date >= paris_now(),
         )
         .order_by(Appointment.date.asc())
         .all()
     )
 
-    for a in upcoming_vet_appointments:
-        if a.date and a.date.tzinfo is None:
-            a.date = a.date.replace(tzinfo=TZ_PARIS)
-
     # 🔹 HISTORIQUE PAR RDV / CHAT (notes, vaccins, tâches, poids)
     #    structure : vet_history[appointment_id][cat_id] = {notes, vaccinations, tasks, weights}
     vet_history = {}
@@ -2802,7 +4881,6 @@ def cat_detail(cat_id):
         task_types=task_types,
         tasks=c.tasks,
         weights=c.weights,
-        TZ_PARIS=TZ_PARIS,
         dewormings=dewormings,
         deworming_types=deworming_types,
         vet_appointments=vet_appointments,
@@ -2987,27 +5065,12 @@ def deworming_batch():
     # ================== GET : dernière pesée + historique groupé ==================
 
     # Dernier poids par chat (pour l’affichage "Dernier poids" dans le tableau)
-    last_weights_sub = (
-        db.session.query(
-            Weight.cat_id,
-            func.max(Weight.date).label("last_date"),
-        )
-        .group_by(Weight.cat_id)
-        .subquery()
-    )
-
-    last_weights = (
-        db.session.query(Weight.cat_id, Weight.weight)
-        .join(
-            last_weights_sub,
-            (Weight.cat_id == last_weights_sub.c.cat_id)
-            & (Weight.date == last_weights_sub.c.last_date),
-        )
+    last_weights_map = dict(
+        db.session.query(CatSummary.cat_id, CatSummary.last_weight)
+        .filter(CatSummary.last_weight.isnot(None))
         .all()
     )
 
-    last_weights_map = {cid: w for cid, w in last_weights}
-
     # Historique groupé par date
     history_rows = (
         db.session.query(
@@ -3306,8 +5369,46 @@ def search_notes():
     )
 
 
+NOTE_API_COLUMNS = {
+    "id": Note.id,
+    "cat_id": Note.cat_id,
+    "cat_name": Cat.name.label("cat_name"),
+    "content": Note.content,
+    "author": Note.author,
+    "veterinarian": Note.veterinarian,
+    "file_name": Note.file_name,
+    "created_at": Note.created_at,
+    "updated_at": Note.updated_at,
+}
+
+# champ JSON -> (colonnes nécessaires, mise en forme d'une ligne)
+NOTE_API_FIELDS = {
+    "id": (("id",), lambda n: n.id),
+    "cat_name": (("cat_name",), lambda n: n.cat_name or ""),
+    "cat_id": (("cat_id",), lambda n: n.cat_id),
+    "content": (("content",), lambda n: n.content or ""),
+    "author": (("author",), lambda n: n.author or "—"),
+    "veterinarian": (("veterinarian",), lambda n: n.veterinarian or None),
+    "file": (("file_name",), lambda n: n.file_name),
+
+    # Création formatée Europe/Paris
+    "created_at": (
+        ("created_at",),
+        lambda n: n.created_at.strftime("%d/%m/%Y %H:%M"),
+    ),
+
+    # Modification formatée Europe/Paris (si disponible)
+    "updated_at": (
+        ("updated_at",),
+        lambda n: n.updated_at.strftime("%d/%m/%Y %H:%M")
+        if n.updated_at else None,
+    ),
+}
+
+
 @app.route("/api/search_notes")
 @site_protected
+@versioned_etag("note", "cat")
 def api_search_notes():
     q = (request.args.get("q") or "").strip().lower()
     cat_id = (request.args.get("cat") or "").strip()
@@ -3316,7 +5417,19 @@ def api_search_notes():
     start = (request.args.get("start") or "").strip()
     end = (request.args.get("end") or "").strip()
 
-    notes = Note.query.join(Cat)
+    try:
+        fields = parse_fields_param(NOTE_API_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Requête "colonnes seules" : pas d'entités Note/Cat, et Note.content
+    # (TEXT) n'est lu que si le champ est demandé.
+    columns = {col for f in fields for col in NOTE_API_FIELDS[f][0]}
+    notes = (
+        db.session.query(*[NOTE_API_COLUMNS[c] for c in sorted(columns)])
+        .select_from(Note)
+        .join(Cat, Cat.id == Note.cat_id)
+    )
 
     # --- Recherche texte ---
     if q:
@@ -3339,17 +5452,16 @@ def api_search_notes():
     if vet:
         notes = notes.filter(Note.veterinarian == vet)
 
-    # --- Filtre date début ---
+    # --- Filtre date début (heure de Paris) ---
     if start:
         start_dt = datetime.strptime(start, "%Y-%m-%d")
-        start_dt = start_dt.replace(tzinfo=TZ_PARIS)
         notes = notes.filter(Note.created_at >= start_dt)
 
     # --- Filtre date fin ---
     if end:
         end_dt = datetime.strptime(end, "%Y-%m-%d")
         # fin de journée locale : 23:59:59
-        end_dt = end_dt.replace(hour=23, minute=59, second=59, tzinfo=TZ_PARIS)
+        end_dt = end_dt.replace(hour=23, minute=59, second=59)
         notes = notes.filter(Note.created_at <= end_dt)
 
     # --- Tri date desc ---
@@ -3357,24 +5469,9 @@ def api_search_notes():
 
     # --- Réponse JSON ---
     return jsonify([
-    {
-        "id": n.id,
-        "cat_name": n.cat.name if n.cat else "",
-        "cat_id": n.cat_id,
-        "content": n.content or "",
-        "author": n.author or "—",
-        "veterinarian": n.veterinarian or None,
-        "file": n.file_name,
-        
-        # Création formatée Europe/Paris
-        "created_at": n.created_at.astimezone(TZ_PARIS).strftime("%d/%m/%Y %H:%M"),
-
-        # Modification formatée Europe/Paris (si disponible)
-        "updated_at": n.updated_at.astimezone(TZ_PARIS).strftime("%d/%m/%Y %H:%M")
-                     if n.updated_at else None,
-    }
-    for n in notes
-])
+        {f: NOTE_API_FIELDS[f][1](n) for f in fields}
+        for n in notes
+    ])
 
 
 
@@ -3382,7 +5479,7 @@ def api_search_notes():
 def search_cats_for_notes():
     q = (request.args.get("q") or "").strip().lower()
 
-    cats = Cat.query
+    cats = db.session.query(Cat.id, Cat.name)
     if q:
         cats = cats.filter(Cat.name.ilike(f"%{q}%"))
 
@@ -3621,14 +5718,119 @@ def supprimer_veterinaire(veterinarian_id):
     db.session.delete(v)
     db.session.commit()
     return redirect(url_for("gestion_veterinaires"))
+
+
+@app.route("/gestion/produits", methods=["GET", "POST"])
+@site_protected
+def gestion_produits():
+    if request.method == "POST":
+        reference = (request.form.get("reference") or "").strip()
+        label = (request.form.get("label") or "").strip()
+        if not reference or not label:
+            flash("Référence et désignation sont obligatoires.", "danger")
+        elif Product.query.filter_by(reference=reference).first():
+            flash("Cette référence existe déjà.", "warning")
+        else:
+            last = db.session.query(func.max(Product.position)).scalar()
+            db.session.add(Product(
+                reference=reference,
+                label=label,
+                position=(last + 1) if last is not None else 0,
+            ))
+            db.session.commit()
+            flash("Article ajouté.", "success")
+        return redirect(url_for("gestion_produits"))
+
+    products = Product.query.order_by(Product.position, Product.id).all()
+    return render_template("manage_products.html", products=products)
+
+
+@app.route("/gestion/produits/modifier/<int:product_id>", methods=["POST"])
+@site_protected
+def modifier_produit(product_id):
+    p = Product.query.get_or_404(product_id)
+
+    reference = (request.form.get("reference") or "").strip()
+    label = (request.form.get("label") or "").strip()
+    if not reference or not label:
+        flash("Référence et désignation sont obligatoires.", "danger")
+        return redirect(url_for("gestion_produits"))
+
+    duplicate = Product.query.filter(Product.reference == reference, Product.id != p.id).first()
+    if duplicate:
+        flash("Cette référence existe déjà.", "warning")
+        return redirect(url_for("gestion_produits"))
+
+    p.reference = reference
+    p.label = label
+    try:
+        p.position = int(request.form.get("position", p.position))
+    except ValueError:
+        pass
+    db.session.commit()
+    flash("Article modifié.", "success")
+    return redirect(url_for("gestion_produits"))
+
+
+@app.route("/gestion/produits/supprimer/<int:product_id>", methods=["POST"])
+@site_protected
+def supprimer_produit(product_id):
+    p = Product.query.get_or_404(product_id)
+    db.session.delete(p)
+    db.session.commit()
+    return redirect(url_for("gestion_produits"))
     
+# -------------------- /api/cats : tri + curseur --------------------
+CAT_SORT_KEYS = ("name", "entry_date", "exit_date", "last_update")
+CATS_PAGE_MAX = 200
+SORT_NULL_DATE = date(1900, 1, 1)
+SORT_NULL_DATETIME = datetime(1900, 1, 1)
+
+
+# champ JSON -> (colonnes nécessaires, mise en forme d'une ligne)
+CAT_API_FIELDS = {
+    "id": (("id",), lambda r: r.id),
+    "name": (("name",), lambda r: r.name),
+    "status": (("status",), lambda r: r.status),
+    "birthdate": (("birthdate",), lambda r: r.birthdate.isoformat() if r.birthdate else None),
+    "age_human": (("birthdate",), lambda r: age_text(r.birthdate)),
+    "photo": (("photo_filename",), lambda r: r.photo_filename),
+    "has_exit": (("exit_date",), lambda r: True if r.exit_date else False),
+    "exit_date": (("exit_date",), lambda r: r.exit_date.isoformat() if r.exit_date else None),
+    "exit_reason": (("exit_reason",), lambda r: r.exit_reason or None),
+    "fiv": (("fiv",), lambda r: r.fiv),
+    "need_vet": (("need_vet",), lambda r: r.need_vet),
+    "tasks_todo": (("tasks_todo",), lambda r: r.tasks_todo),
+    "last_update": (
+        ("last_note_at", "last_task_at", "last_vacc_date"),
+        lambda r: last_update_text(r.last_note_at, r.last_task_at, r.last_vacc_date),
+    ),
+}
+
+
+def encode_cat_cursor(sort_value, cat_id: int) -> str:
+    if isinstance(sort_value, (date, datetime)):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, cat_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cat_cursor(cursor: str, sort_key: str):
+    sort_value, cat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if sort_key in ("entry_date", "exit_date"):
+        sort_value = date.fromisoformat(sort_value)
+    elif sort_key == "last_update":
+        sort_value = datetime.fromisoformat(sort_value)
+    else:
+        sort_value = str(sort_value)
+    return sort_value, int(cat_id)
+
+
 @app.route("/api/cats", methods=["GET", "POST"])
+@api_protected
+@versioned_etag("cat", "cat_task", "note", "vaccination", "deworming", daily=True)
 def api_cats():
 
-    # 🔐 Sécurité API : l’utilisateur doit être loggé
-    if session.get("authenticated") is not True:
-        return jsonify({"error": "unauthorized"}), 401
-
     # ------------------ CRÉATION (POST) ------------------
     if request.method == "POST":
         name = (request.form.get("name") or "").strip()
@@ -3656,6 +5858,7 @@ def api_cats():
                 if request.form.get("entry_date")
                 else None,
                 entry_reason=request.form.get("entry_reason"),
+                entry_reason_code=reason_code(request.form.get("entry_reason"), ENTRY_REASON_CODES),
                 gender=request.form.get("gender") or None,
             )
         )
@@ -3675,125 +5878,757 @@ def api_cats():
     entry_start = (request.args.get("entry_start") or "").strip()
     entry_end = (request.args.get("entry_end") or "").strip()
 
-    query = Cat.query
+    # Pagination par curseur (facultative : sans "limit", toute la liste)
+    sort = (request.args.get("sort") or "name").strip()            # "name", "-entry_date", ...
+    after = (request.args.get("after") or "").strip()
+    limit = request.args.get("limit", type=int)
+
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in CAT_SORT_KEYS:
+        return jsonify({"error": f"sort inconnu : {sort_key}"}), 400
+    if limit is not None:
+        limit = max(1, min(limit, CATS_PAGE_MAX))
+
+    filters = []
 
     # Nom
     if q:
-        query = query.filter(Cat.name.ilike(f"%{q}%"))
+        filters.append(Cat.name.ilike(f"%{q}%"))
 
     # Numéro d'identification
     if ident:
-        query = query.filter(Cat.identification_number.ilike(f"%{ident}%"))
+        filters.append(Cat.identification_number.ilike(f"%{ident}%"))
 
     # Statut exact
     if status:
-        query = query.filter(Cat.status == status)
+        filters.append(Cat.status == status)
 
     # Présent / sorti
     if present == "present":
         # Chats présents au refuge
-        query = query.filter(
-            Cat.exit_date.is_(None),
-            Cat.status.notin_(["adopté", "décédé", "famille d'accueil"]),
-        )
+        filters.append(Cat.exit_date.is_(None))
+        filters.append(Cat.status.notin_(["adopté", "décédé", "famille d'accueil"]))
     elif present == "exited":
         # Chats sortis (avec une date de sortie)
-        query = query.filter(Cat.exit_date.is_not(None))
+        filters.append(Cat.exit_date.is_not(None))
 
     # Raison de sortie (contient le texte sélectionné)
     if exit_reason:
-        query = query.filter(Cat.exit_reason.ilike(f"%{exit_reason}%"))
+        filters.append(Cat.exit_reason.ilike(f"%{exit_reason}%"))
 
     # Date d'entrée
     if entry_start:
         try:
             d_start = datetime.strptime(entry_start, "%Y-%m-%d").date()
-            query = query.filter(Cat.entry_date >= d_start)
+            filters.append(Cat.entry_date >= d_start)
         except Exception:
             pass
 
     if entry_end:
         try:
             d_end = datetime.strptime(entry_end, "%Y-%m-%d").date()
-            query = query.filter(Cat.entry_date <= d_end)
+            filters.append(Cat.entry_date <= d_end)
         except Exception:
             pass
 
-    # Avec au moins une tâche active
+    # Avec au moins une tâche active (EXISTS : pas de doublons, pas de DISTINCT)
     if has_task == "1":
-        query = (
-            query.join(CatTask, CatTask.cat_id == Cat.id)
-            .filter(CatTask.is_done.is_(False))
-        )
+        filters.append(Cat.tasks.any(CatTask.is_done.is_(False)))
 
     # Sans vaccination
     if no_vacc == "1":
-        query = query.filter(~Cat.vaccinations.any())
+        filters.append(~Cat.vaccinations.any())
 
     # Sans vermifuge
     if no_deworm == "1":
-        query = query.filter(~Cat.dewormings.any())
+        filters.append(~Cat.dewormings.any())
+
+    # 🔥 Une seule requête SQL : les agrégats par chat (tâches en cours,
+    #    dernière note / tâche / vaccin) sont lus dans cat_summary (1 ligne
+    #    par chat, tenue à jour à l'écriture), jointe sur sa clé primaire.
+    # Clé de tri : NULL remplacé par une date sentinelle pour que le
+    # curseur (valeur, id) reste comparable.
+    if sort_key == "name":
+        sort_expr = Cat.name
+    elif sort_key == "last_update":
+        sort_expr = greatest(
+            func.coalesce(CatSummary.last_note_at, SORT_NULL_DATETIME),
+            func.coalesce(CatSummary.last_task_at, SORT_NULL_DATETIME),
+            func.coalesce(date_to_timestamp(CatSummary.last_vacc_date), SORT_NULL_DATETIME),
+        )
+    else:
+        sort_expr = func.coalesce(getattr(Cat, sort_key), SORT_NULL_DATE)
+
+    # Projection : seules les colonnes des champs demandés sont lues, et
+    # cat_summary n'est jointe que si un champ (ou le tri) en a besoin.
+    try:
+        fields = parse_fields_param(CAT_API_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    needed = {col for f in fields for col in CAT_API_FIELDS[f][0]}
+    if sort_key == "last_update":
+        needed |= {"last_note_at", "last_task_at", "last_vacc_date"}
+
+    summary_columns = {
+        "tasks_todo": func.coalesce(CatSummary.tasks_todo, 0).label("tasks_todo"),
+        "last_task_at": CatSummary.last_task_at,
+        "last_note_at": CatSummary.last_note_at,
+        "last_vacc_date": CatSummary.last_vacc_date,
+    }
+
+    columns = [Cat.id, sort_expr.label("sort_value")]
+    for col in sorted(needed - {"id"}):
+        columns.append(summary_columns[col] if col in summary_columns else getattr(Cat, col))
+
+    query = db.session.query(*columns)
+    if needed & set(summary_columns):
+        query = query.outerjoin(CatSummary, CatSummary.cat_id == Cat.id)
+    query = query.filter(*filters)
+
+    if after:
+        try:
+            after_value, after_id = decode_cat_cursor(after, sort_key)
+        except (ValueError, TypeError):
+            return jsonify({"error": "curseur invalide"}), 400
+        key = db.tuple_(sort_expr, Cat.id)
+        query = query.filter(key < (after_value, after_id) if descending else key > (after_value, after_id))
+
+    if descending:
+        query = query.order_by(sort_expr.desc(), Cat.id.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), Cat.id.asc())
+
+    if limit is not None:
+        # une ligne de plus pour savoir s'il existe une page suivante
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = query.all()
+        has_more = False
+
+    out = [
+        {f: CAT_API_FIELDS[f][1](r) for f in fields}
+        for r in rows
+    ]
+
+    resp = jsonify(out)
+
+    if limit is not None:
+        if has_more:
+            resp.headers["X-Next-Cursor"] = encode_cat_cursor(rows[-1].sort_value, rows[-1].id)
+
+        # Compteurs globaux (1ère page seulement) : un simple COUNT sur cat,
+        # sans les sous-requêtes d'agrégats.
+        if not after:
+            total, present_count, need_vet_count, fiv_count = (
+                db.session.query(
+                    func.count(Cat.id),
+                    func.count(db.case((Cat.exit_date.is_(None), Cat.id))),
+                    func.count(db.case((Cat.need_vet.is_(True), Cat.id))),
+                    func.count(db.case((Cat.fiv.is_(True), Cat.id))),
+                )
+                .filter(*filters)
+                .one()
+            )
+            resp.headers["X-Total-Count"] = str(total)
+            resp.headers["X-Present-Count"] = str(present_count)
+            resp.headers["X-Need-Vet-Count"] = str(need_vet_count)
+            resp.headers["X-Fiv-Count"] = str(fiv_count)
+
+    return resp
+
+
+
+
+OCCUPANCY_MAX_DAYS = 3700   # ~10 ans en pas journalier
+
+
+@app.route("/api/occupancy")
+@api_protected
+@versioned_etag("cat")
+def api_occupancy():
+    """
+    Série d'effectif pour une période :
+      ?start=AAAA-MM-JJ&end=AAAA-MM-JJ&step=day|month
+    (par défaut : les 12 derniers mois, mois par mois).
+    """
+    today = date.today()
+    step = request.args.get("step") or "month"
+    if step not in ("day", "month"):
+        return jsonify({"error": f"step inconnu : {step}"}), 400
+
+    try:
+        end = date.fromisoformat(request.args["end"]) if request.args.get("end") else today
+        start = (
+            date.fromisoformat(request.args["start"]) if request.args.get("start")
+            else (end - relativedelta(months=11)).replace(day=1)
+        )
+    except ValueError:
+        return jsonify({"error": "dates attendues au format AAAA-MM-JJ"}), 400
+
+    if start > end:
+        return jsonify({"error": "start doit précéder end"}), 400
+    if step == "day" and (end - start).days >= OCCUPANCY_MAX_DAYS:
+        return jsonify({"error": f"au plus {OCCUPANCY_MAX_DAYS} jours en pas journalier"}), 400
+
+    return jsonify(occupancy_series(start, end, step))
+
+
+# ============================================================
+# RÉSUMÉS PAR CHAT (flask rebuild-summaries / check-summaries)
+# ============================================================
+
+@app.cli.command("rebuild-summaries")
+def rebuild_summaries_command():
+    """Recalcule entièrement cat_summary, cat_vaccine_summary et due_reminders."""
+    refresh_cat_summaries(db.session.connection())
+    db.session.commit()
+    click.echo(f"✅ Résumés recalculés pour {CatSummary.query.count()} chat(s).")
+
+
+def cat_summary_mismatches() -> list[str]:
+    """Compare les résumés stockés aux valeurs recalculées depuis l'historique."""
+    problems = []
+
+    stored = {r.cat_id: tuple(r) for r in db.session.execute(select(*CatSummary.__table__.columns))}
+    expected = {r.cat_id: tuple(r) for r in db.session.execute(cat_summary_select())}
+    for cat_id in sorted(set(stored) | set(expected)):
+        if stored.get(cat_id) != expected.get(cat_id):
+            problems.append(f"cat_summary chat {cat_id} : stocké={stored.get(cat_id)} attendu={expected.get(cat_id)}")
+
+    stored_v = {
+        (r.cat_id, r.vaccine_type_id): tuple(r)
+        for r in db.session.execute(select(*CatVaccineSummary.__table__.columns))
+    }
+    expected_v = {
+        (r.cat_id, r.vaccine_type_id): tuple(r)
+        for r in db.session.execute(cat_vaccine_summary_select())
+    }
+    for key in sorted(set(stored_v) | set(expected_v)):
+        if stored_v.get(key) != expected_v.get(key):
+            problems.append(f"cat_vaccine_summary {key} : stocké={stored_v.get(key)} attendu={expected_v.get(key)}")
+
+    due_cols = (DueReminder.cat_id, DueReminder.kind, DueReminder.vaccine_type_id,
+                DueReminder.last_date, DueReminder.next_due)
+    stored_d = {(r[0], r[1], r[2]): tuple(r) for r in db.session.execute(select(*due_cols))}
+    expected_d = {(r[0], r[1], r[2]): tuple(r) for r in db.session.execute(due_reminders_select())}
+    for key in sorted(set(stored_d) | set(expected_d), key=str):
+        if stored_d.get(key) != expected_d.get(key):
+            problems.append(f"due_reminders {key} : stocké={stored_d.get(key)} attendu={expected_d.get(key)}")
+
+    return problems
+
+
+@app.cli.command("check-summaries")
+def check_summaries_command():
+    """Vérifie que les résumés correspondent à l'historique (code retour 1 sinon)."""
+    problems = cat_summary_mismatches()
+    for p in problems[:50]:
+        click.echo(f"❌ {p}")
+    if problems:
+        click.echo(f"{len(problems)} incohérence(s). Lancer : flask rebuild-summaries")
+        raise SystemExit(1)
+    click.echo("✅ Résumés cohérents.")
+
 
-    # éviter les doublons si join sur CatTask
-    query = query.distinct().order_by(Cat.name)
+# ============================================================
+# TÂCHE NOCTURNE (rappels)
+# ============================================================
+# due_reminders est tenue à jour à chaque commit (voir refresh_cat_summaries).
+# Le statut retard / à venir est calculé à la lecture à partir de next_due :
+# le passage au jour suivant ne demande donc aucune réécriture. La tâche de
+# nuit recalcule tout pour rattraper les écritures faites hors de l'ORM
+# (SQL manuel, restauration de sauvegarde…).
+REMINDERS_REFRESH_HOUR = 3   # heure de Paris
+
+_reminders_scheduler_started = False
+_reminders_scheduler_lock = threading.Lock()
+
+
+def seconds_until_next_refresh(now: datetime) -> float:
+    """Secondes jusqu'au prochain passage de REMINDERS_REFRESH_HOUR (heure de Paris)."""
+    next_run = now.replace(hour=REMINDERS_REFRESH_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def nightly_reminders_refresh():
+    """Recalcule entièrement les résumés et due_reminders, dans sa propre transaction."""
+    with app.app_context():
+        try:
+            refresh_cat_summaries(db.session.connection())
+            db.session.commit()
+            print(f"✅ Rappels recalculés ({DueReminder.query.count()} ligne(s)).")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Recalcul nocturne des rappels : {e}")
+        finally:
+            db.session.remove()
+
+
+def _reminders_scheduler_loop():
+    while True:
+        time.sleep(seconds_until_next_refresh(datetime.now(TZ_PARIS)))
+        nightly_reminders_refresh()
+
+
+@app.before_request
+def start_reminders_scheduler():
+    """
+    Lance le thread de la tâche de nuit à la première requête du process
+    (pas dans les commandes flask ...).
+    """
+    global _reminders_scheduler_started
+    if _reminders_scheduler_started:
+        return
+    with _reminders_scheduler_lock:
+        if not _reminders_scheduler_started:
+            threading.Thread(target=_reminders_scheduler_loop, name="reminders-nightly", daemon=True).start()
+            _reminders_scheduler_started = True
+
+
+# ============================================================
+# MESURES DE PERFORMANCE (flask bench ...)
+# ============================================================
+# Les commandes insèrent des données synthétiques dans la transaction en
+# cours, mesurent, puis font un rollback : rien n'est conservé en base.
+
+bench_cli = AppGroup("bench", help="Mesures de performance sur données synthétiques.")
+app.cli.add_command(bench_cli)
+
+
+class QueryCounter:
+    """Compte les requêtes SQL envoyées à la base dans un bloc `with`."""
 
-    cats = query.all()
+    def __init__(self):
+        self.count = 0
 
-    out = []
-    for c in cats:
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
 
-        # --- Nombre de tâches en cours ---
-        tasks_todo = CatTask.query.filter_by(cat_id=c.id, is_done=False).count()
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self._on_execute)
+        return self
 
-        # --- Dernière modification (note / tâche / vaccin) ---
-        last_dates = []
+    def __exit__(self, *exc):
+        event.remove(db.engine, "before_cursor_execute", self._on_execute)
 
-        if c.notes:
-            last_dates.append(
-                max(n.created_at.astimezone(TZ_PARIS) for n in c.notes)
+
+def seed_synthetic_history(n_cats: int, years: int = 1, seed: int = 42) -> list[int]:
+    """
+    Insère (sans commit) n_cats chats avec un historique réaliste sur `years` ans :
+    vaccins (primo puis rappel annuel par type), vermifuges + pesées tous les
+    2 mois, notes et tâches. Retourne les ids des chats créés.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    first_day = today - timedelta(days=365 * years)
+
+    vaccine_types = [VaccineType(name=f"Bench {n} {seed}") for n in ("Typhus", "Coryza", "Leucose")]
+    task_type = TaskType(name=f"Bench tâche {seed}")
+    deworming_type = DewormingType(name=f"Bench vermifuge {seed}")
+    db.session.add_all(vaccine_types + [task_type, deworming_type])
+    db.session.flush()
+
+    cats = []
+    for i in range(n_cats):
+        entry = first_day + timedelta(days=rng.randrange((today - first_day).days + 1))
+        cat = Cat(
+            name=f"Bench {i:05d}",
+            entry_date=entry,
+            entry_reason=rng.choice(["Abandon", "Trouvé", "Retours après placement"]),
+            status="normal",
+        )
+        cat.entry_reason_code = reason_code(cat.entry_reason, ENTRY_REASON_CODES)
+        if rng.random() < 0.25 and entry < today:
+            cat.exit_date = entry + timedelta(days=rng.randrange(1, (today - entry).days + 1))
+            cat.exit_reason, cat.status = rng.choice(
+                [("Placé", "adopté"), ("Décédé", "décédé"), ("Transféré", "normal")]
             )
+            cat.exit_reason_code = reason_code(cat.exit_reason, EXIT_REASON_CODES)
+        cats.append(cat)
+    db.session.add_all(cats)
+    db.session.flush()
+
+    vaccs, dewormings, weights, notes, tasks = [], [], [], [], []
+    for cat in cats:
+        end = cat.exit_date or today
+
+        for vt in vaccine_types:
+            d, primo = cat.entry_date, True
+            while d <= end:
+                vaccs.append({"cat_id": cat.id, "vaccine_type_id": vt.id, "date": d, "primo": primo})
+                d += timedelta(days=30 if primo else 365)
+                primo = False
+
+        d = cat.entry_date
+        while d <= end:
+            dewormings.append({"cat_id": cat.id, "deworming_type_id": deworming_type.id, "date": d})
+            weights.append({"cat_id": cat.id, "date": d, "weight": round(rng.uniform(2.5, 6.0), 1)})
+            notes.append({
+                "cat_id": cat.id,
+                "content": "Note synthétique",
+                "created_at": datetime.combine(d, datetime.min.time()).replace(tzinfo=TZ_PARIS),
+            })
+            d += timedelta(days=60)
+
+        for _ in range(rng.randrange(3)):
+            tasks.append({
+                "cat_id": cat.id,
+                "task_type_id": task_type.id,
+                "created_at": datetime.now(TZ_PARIS),
+                "is_done": rng.random() < 0.5,
+            })
 
-        if c.tasks:
-            last_dates.append(
-                max(t.created_at.astimezone(TZ_PARIS) for t in c.tasks)
+    for model, rows in (
+        (Vaccination, vaccs),
+        (Deworming, dewormings),
+        (Weight, weights),
+        (Note, notes),
+        (CatTask, tasks),
+    ):
+        if rows:
+            db.session.execute(insert(model), rows)
+
+    flush_cat_summaries()
+    return [c.id for c in cats]
+
+
+def page_through_api_cats(client, sort: str, limit: int) -> list[int]:
+    """Ids renvoyés par /api/cats en suivant X-Next-Cursor jusqu'à la dernière page."""
+    ids, cursor = [], None
+    while True:
+        params = {"sort": sort, "fields": "id", "limit": limit}
+        if cursor:
+            params["after"] = cursor
+        resp = client.get("/api/cats", query_string=params)
+        ids += [row["id"] for row in resp.get_json()]
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+def authenticated_test_client():
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["authenticated"] = True
+    return client
+
+
+@bench_cli.command("api-cats")
+@click.option("--sizes", default="50,600", help="Tailles de registre à comparer (ex : 50,600).")
+def bench_api_cats(sizes):
+    """Vérifie que GET /api/cats fait un nombre constant de requêtes SQL."""
+    client = authenticated_test_client()
+    query_counts = {}
+
+    for n in [int(x) for x in sizes.split(",")]:
+        try:
+            seed_synthetic_history(n)
+            with QueryCounter() as qc:
+                t0 = time.perf_counter()
+                resp = client.get("/api/cats")
+                elapsed = time.perf_counter() - t0
+            query_counts[n] = qc.count
+            click.echo(
+                f"{n:>6} chats : {qc.count} requête(s), {elapsed * 1000:.1f} ms, "
+                f"{len(resp.get_json())} lignes"
             )
 
-        if c.vaccinations:
-            last_dates.append(
-                max(
-                    datetime.combine(v.date, datetime.min.time()).replace(
-                        tzinfo=TZ_PARIS
+            # Pagination par curseur : chaque chat une fois et une seule
+            for sort in CAT_SORT_KEYS + tuple(f"-{k}" for k in CAT_SORT_KEYS):
+                ids = page_through_api_cats(client, sort, limit=7)
+                if len(ids) != len(set(ids)) or len(ids) != len(resp.get_json()):
+                    raise click.ClickException(
+                        f"sort={sort} : {len(ids)} ids sur les pages, "
+                        f"{len(set(ids))} distincts, {len(resp.get_json())} attendus"
                     )
-                    for v in c.vaccinations
-                )
-            )
+        finally:
+            db.session.rollback()
+
+    if len(set(query_counts.values())) != 1:
+        raise click.ClickException(f"Nombre de requêtes variable : {query_counts}")
+    click.echo("✅ /api/cats : nombre de requêtes indépendant du nombre de chats.")
+
+
+def compare_bench_variants(variants: dict, repeat: int):
+    """
+    Chronomètre chaque variante (meilleur de `repeat` passes, session vidée
+    entre deux) et vérifie qu'elles renvoient toutes le même résultat que
+    la première, qui sert de référence.
+    """
+    reference = None
+    for label, run in variants.items():
+        best, queries = None, 0
+        for _ in range(repeat):
+            db.session.expunge_all()
+            with QueryCounter() as qc:
+                t0 = time.perf_counter()
+                result = run()
+                elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+            queries = qc.count
+
+        if reference is None:
+            reference = result
+        same = "identique" if result == reference else "⚠️ DIFFÉRENT"
+        click.echo(
+            f"{label:<32} {best * 1000:>9.1f} ms  {queries:>6} requête(s)  "
+            f"{len(result)} rappel(s), {same}"
+        )
+        if result != reference:
+            raise click.ClickException(f"{label} : résultat différent de l'ancien calcul")
+
+
+def legacy_compute_vaccines_due(days: int = 30):
+    """Ancien calcul (boucle Python sur chats x vaccins), gardé comme référence."""
+    today = date.today()
+    limit = today + timedelta(days=days)
+    results = []
+
+    vaccine_types = VaccineType.query.all()
+    cats = Cat.query.filter(
+        db.or_(
+            Cat.exit_date.is_(None),
+            Cat.status == "famille d'accueil"
+        ),
+        Cat.status.notin_(["adopté", "décédé"])
+    ).all()
+
+    for cat in cats:
+        last_by_type = {}
+        for v in cat.vaccinations:
+            vt = v.vaccine_type_id
+            if vt not in last_by_type or v.date > last_by_type[vt].date:
+                last_by_type[vt] = v
+
+        for vt in vaccine_types:
+            if vt.id not in last_by_type:
+                continue
+            last_vacc = last_by_type[vt.id]
+            next_due = last_vacc.date + timedelta(days=30 if last_vacc.primo else 365)
+            if next_due < today:
+                results.append((cat.id, vt.id, last_vacc.date, next_due, "late"))
+            elif next_due <= limit:
+                results.append((cat.id, vt.id, last_vacc.date, next_due, "soon"))
+
+    return results
+
+
+@bench_cli.command("vaccines")
+@click.option("--cats", "n_cats", default=2000, help="Nombre de chats synthétiques.")
+@click.option("--years", default=10, help="Années d'historique.")
+@click.option("--repeat", default=3, help="Répétitions par variante (meilleur temps gardé).")
+def bench_vaccines(n_cats, years, repeat):
+    """Compare les calculs de rappels de vaccin (ancien / fenêtre SQL / résumé / due_reminders)."""
+    today = date.today()
+    limit = today + timedelta(days=30)
+
+    def as_tuples(rows):
+        return sorted(
+            (cat.id, vt.id, last_date, next_due, "late" if next_due < today else "soon")
+            for cat, vt, last_date, next_due in rows
+        )
+
+    variants = {
+        "ancien (boucle Python)": lambda: sorted(legacy_compute_vaccines_due(30)),
+        "ROW_NUMBER() sur l'historique": lambda: as_tuples(
+            vaccines_due_query(
+                vaccine_reminders_select(cat_vaccine_summary_select().subquery()).subquery(), limit
+            ).all()
+        ),
+        "résumé cat_vaccine_summary": lambda: as_tuples(
+            vaccines_due_query(vaccine_reminders_select(CatVaccineSummary.__table__).subquery(), limit).all()
+        ),
+        "table due_reminders": lambda: sorted(
+            (r["cat"].id, r["vaccine"].id, r["last_date"], r["next_due"], r["status"])
+            for r in compute_vaccines_due(30)
+        ),
+    }
+
+    try:
+        t0 = time.perf_counter()
+        seed_synthetic_history(n_cats, years=years)
+        click.echo(
+            f"Données : {n_cats} chats, {years} ans, "
+            f"{Vaccination.query.count()} vaccinations ({time.perf_counter() - t0:.1f} s)"
+        )
+
+        compare_bench_variants(variants, repeat)
+    finally:
+        db.session.rollback()
+
+
+def legacy_compute_dewormings_due(days: int = 7):
+    """Ancien calcul (historique complet chargé par chat), gardé comme référence."""
+    today = date.today()
+    limit = today + timedelta(days=days)
+    results = []
+
+    cats = Cat.query.filter(
+        db.or_(
+            Cat.exit_date.is_(None),
+            Cat.status == "famille d'accueil"
+        ),
+        Cat.status.notin_(["adopté", "décédé"])
+    ).all()
+
+    for cat in cats:
+        if not cat.dewormings:
+            continue
+        last = max(cat.dewormings, key=lambda d: d.date)
+        next_due = last.date + relativedelta(months=2)
+        if next_due < today:
+            results.append((cat.id, last.date, next_due, "late"))
+        elif next_due <= limit:
+            results.append((cat.id, last.date, next_due, "soon"))
+
+    return results
+
+
+@bench_cli.command("dewormings")
+@click.option("--cats", "n_cats", default=2000, help="Nombre de chats synthétiques.")
+@click.option("--years", default=10, help="Années d'historique.")
+@click.option("--repeat", default=3, help="Répétitions par variante (meilleur temps gardé).")
+def bench_dewormings(n_cats, years, repeat):
+    """Compare les calculs de rappels de vermifuge (ancien / max groupé / résumé / due_reminders)."""
+    today = date.today()
+    limit = today + timedelta(days=7)
+
+    def as_tuples(rows):
+        return sorted(
+            (cat.id, last_date, next_due, "late" if next_due < today else "soon")
+            for cat, last_date, next_due in rows
+        )
+
+    grouped_max = (
+        db.select(
+            Deworming.cat_id.label("cat_id"),
+            db.func.max(Deworming.date).label("last_date"),
+        )
+        .group_by(Deworming.cat_id)
+    )
+    summary = db.select(
+        CatSummary.cat_id.label("cat_id"),
+        CatSummary.last_deworming_date.label("last_date"),
+    )
+
+    variants = {
+        "ancien (boucle Python)": lambda: sorted(legacy_compute_dewormings_due(7)),
+        "max() groupé sur l'historique": lambda: as_tuples(
+            dewormings_due_query(deworming_reminders_select(grouped_max.subquery()).subquery(), limit).all()
+        ),
+        "résumé cat_summary": lambda: as_tuples(
+            dewormings_due_query(deworming_reminders_select(summary.subquery()).subquery(), limit).all()
+        ),
+        "table due_reminders": lambda: sorted(
+            (r["cat"].id, r["last_date"], r["next_due"], r["status"])
+            for r in compute_dewormings_due(7)
+        ),
+    }
 
-        last_update = "—"
-        if last_dates:
-            last_update = max(last_dates).strftime("%d/%m/%Y %H:%M")
-
-        out.append(
-            {
-                "id": c.id,
-                "name": c.name,
-                "status": c.status,
-                "birthdate": c.birthdate.isoformat() if c.birthdate else None,
-                "age_human": age_text(c.birthdate),
-                "photo": c.photo_filename,
-                "has_exit": True if c.exit_date else False,
-                "has_exit": True if c.exit_date else False,
-                "exit_date": c.exit_date.isoformat() if c.exit_date else None,
-                "exit_reason": c.exit_reason or None,
-                "fiv": c.fiv,
-                "need_vet": c.need_vet,
-                "tasks_todo": tasks_todo,
-                "last_update": last_update,
-            }
+    try:
+        t0 = time.perf_counter()
+        seed_synthetic_history(n_cats, years=years)
+        click.echo(
+            f"Données : {n_cats} chats, {years} ans, "
+            f"{Deworming.query.count()} vermifuges ({time.perf_counter() - t0:.1f} s)"
         )
+        compare_bench_variants(variants, repeat)
+    finally:
+        db.session.rollback()
+
 
-    return jsonify(out)
+@bench_cli.command("occupancy")
+@click.option("--cats", "n_cats", default=2000, help="Nombre de chats synthétiques.")
+@click.option("--years", default=5, help="Années d'historique.")
+def bench_occupancy(n_cats, years):
+    """Compare occupancy_series à count_cats_present_on sur chaque jour."""
+    try:
+        seed_synthetic_history(n_cats, years=years)
+        end = date.today()
+        start = end - timedelta(days=365 * years)
+        days = (end - start).days + 1
+
+        with QueryCounter() as qc:
+            t0 = time.perf_counter()
+            series = occupancy_series(start, end, "day")
+            sweep_ms = (time.perf_counter() - t0) * 1000
+        click.echo(f"Balayage : {days} jours en {sweep_ms:.1f} ms, {qc.count} requête(s)")
+
+        with QueryCounter() as qc:
+            t0 = time.perf_counter()
+            expected = [count_cats_present_on(start + timedelta(days=i)) for i in range(days)]
+            count_ms = (time.perf_counter() - t0) * 1000
+        click.echo(f"COUNT par jour : {days} jours en {count_ms:.1f} ms, {qc.count} requête(s)")
+
+        wrong = [
+            (point["period"], point["present"], n)
+            for point, n in zip(series, expected)
+            if point["present"] != n
+        ]
+        for period, got, want in wrong[:10]:
+            click.echo(f"❌ {period} : balayage={got} COUNT={want}")
+        if wrong:
+            raise click.ClickException(f"{len(wrong)} jour(s) différent(s)")
+        click.echo("✅ Effectif identique sur tous les jours.")
+    finally:
+        db.session.rollback()
+
+
+@bench_cli.command("pdf")
+@click.option("--runs", default=20, help="Nombre de rendus par générateur.")
+def bench_pdf(runs):
+    """Temps et allocations par PDF, ressources partagées vs reconstruites."""
+    today = date.today()
+    counts = compute_activity_stats(today.year, today.month)["counts"]
+    species = [{"name": "Lapins", "count": 3}]
+    products = purchase_order_products()
+    quantities = {ref: "2" for ref, _ in products[::3]}
+    now_ts = datetime.now(TZ_PARIS)
 
+    generators = {
+        "rapport d'activité": lambda: render_activity_report_pdf(
+            io.BytesIO(), today.year, today.month, counts, species, species),
+        "bon de commande": lambda: render_purchase_order_pdf(
+            io.BytesIO(), products, quantities, now_ts),
+    }
 
+    def run_once(render, cold):
+        if cold:
+            pdf_logo.cache_clear()
+            pdf_paragraph_style.cache_clear()
+        render()
+
+    def measure(render, cold):
+        # temps sans tracemalloc (qui ralentit chaque allocation)
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            run_once(render, cold)
+        ms = (time.perf_counter() - t0) * 1000 / runs
+
+        peak = kept = 0
+        for _ in range(runs):
+            tracemalloc.start()
+            run_once(render, cold)
+            size, run_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak = max(peak, run_peak)
+            kept += size
+        return ms, peak, kept / runs
+
+    for name, render in generators.items():
+        render()  # chauffe : polices et ressources partagées
+        for label, cold in (("reconstruites", True), ("partagées", False)):
+            ms, peak, kept = measure(render, cold)
+            click.echo(
+                f"{name:<20} ressources {label:<13}: {ms:7.2f} ms/PDF, "
+                f"pic {peak / 1024:8.1f} Kio, retenu {kept / 1024:7.1f} Kio"
+            )
 
 
 # ============================================================
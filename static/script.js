@@ -1,2 +1,40 @@
 // JS global (placeholder)
 console.log("Refuge loaded");
+
+// Synchro incrémentale d'un calendrier FullCalendar alimenté par
+// /api/appointments : toutes les `intervalMs`, on ne récupère que les RDV
+// modifiés / supprimés depuis la synchro précédente (?updated_since=).
+function startCalendarSync(calendar, since, intervalMs = 60000) {
+    if (!since) return;
+
+    function poll() {
+        const params = new URLSearchParams({ updated_since: since });
+        fetch("/api/appointments?" + params.toString(), { credentials: "same-origin" })
+            .then(r => (r.ok ? r.json() : null))
+            .then(data => {
+                if (!data) return;
+                const source = calendar.getEventSources()[0];
+
+                // id d'un RDV, ou groupId d'un RDV général (toutes ses occurrences)
+                function removeEvents(id) {
+                    calendar.getEvents().forEach(ev => {
+                        if (ev.id === id || ev.groupId === id) ev.remove();
+                    });
+                }
+
+                data.deleted.forEach(removeEvents);
+                data.events.forEach(ev => {
+                    removeEvents(ev.groupId || String(ev.id));
+                    // rattaché à la source : remplacé au prochain changement de vue
+                    calendar.addEvent(ev, source);
+                });
+                // série modifiée : occurrences recalculées côté serveur
+                if (data.refetch) calendar.refetchEvents();
+                since = data.server_time;
+            })
+            .catch(() => {})
+            .finally(() => setTimeout(poll, intervalMs));
+    }
+
+    setTimeout(poll, intervalMs);
+}